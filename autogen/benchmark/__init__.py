@@ -0,0 +1,10 @@
+"""
+benchmarks for patch.py, runnable without a Steam install
+
+    python -m benchmark --mods 100 --out results.json [--baseline old_results.json]
+
+run from the autogen directory.\n
+`corpus` ... writes a seeded synthetic workshop / game directory\n
+`stages` ... times tokenize, split3, transform and export separately\n
+`pipeline` ... time to the first output byte and peak memory of each generator
+"""
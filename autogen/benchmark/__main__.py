@@ -0,0 +1,71 @@
+"""
+generate a synthetic corpus, measure it, and write the results as json.\n
+with `--baseline`, the stages that got slower than in the baseline results by more than `--tolerance` are reported,
+and the exit status is 1
+"""
+
+import os
+import sys
+import json
+import platform
+import argparse
+import tempfile
+import contextlib
+
+import patch
+
+from benchmark import corpus, stages, pipeline
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, t in results['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if old and t > old * (1 + tolerance):
+            regressions.append((name, old, t))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmark", description="benchmark patch.py on a synthetic corpus")
+    parser.add_argument("--mods", type=int, default=100, help="number of generated mods (default: 100)")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the corpus generator (default: 1)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each stage, the best one is kept (default: 3)")
+    parser.add_argument("--out", help="write the results to this json file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline (default: 0.2)")
+    parser.add_argument("--keep", help="generate the corpus in this directory and keep it, instead of a temporary one")
+    args = parser.parse_args()
+
+    patch.PARSE_CACHE = False
+
+    with contextlib.ExitStack() as stack:
+        root = args.keep or stack.enter_context(tempfile.TemporaryDirectory())
+        workshop, game, exported_json = corpus.generate(root, args.mods, args.seed)
+        patch.env = patch.ModEnvironment(workshop, game, exported_json)
+        with contextlib.redirect_stdout(None):
+            stage_times, statistics = stages.measure(args.repeat)
+            generators = {name: pipeline.run(name, f, patch.ModCorpus()) for name, (f, _, _, _) in patch.generators.items()}
+
+    results = {
+        'seed': args.seed,
+        'python': platform.python_version(),
+        'corpus': statistics,
+        'stages': stage_times,
+        'generators': generators,
+    }
+
+    print('%(mods)s mods, %(files)s files, %(bytes)s bytes, %(tokens)s tokens' % statistics)
+    for name, t in stage_times.items():
+        print('  %-20s %8.1f ms' % (name, t * 1e3))
+    for name, r in generators.items():
+        print('  %-20s first byte after %.1f ms, peak %.1f MB' % (name, r['first_byte'] * 1e3 if r['first_byte'] is not None else -1, r['peak_memory'] / 1e6))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, old, new in regressions:
+            print('REGRESSION %s: %.1f ms -> %.1f ms' % (name, old * 1e3, new * 1e3))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,190 @@
+"""
+seeded generator of synthetic mod directories, shaped like the scripts patch.py reads:
+pop_jobs with resources, modifiers and mults, buildings with `num_pops` triggers, local and global `@variables` and inline scripts.\n
+the same (seed, mods) always gives the same files, so results of different runs can be compared
+"""
+
+import os
+import json
+import random
+
+RESOURCES = [b'energy', b'minerals', b'food', b'alloys', b'unity', b'consumer_goods', b'physics_research', b'influence']
+MODIFIERS = [b'pop_happiness', b'planet_stability_add', b'planet_crime_add', b'country_unity_produces_add', b'planet_amenities_add', b'pop_housing_usage_mult']
+OPERATORS = [b'>=', b'<=', b'>', b'<']
+
+class ModWriter:
+    """
+    writes the scripts of one mod (or of vanilla) below `base`
+    """
+    def __init__(self, rnd, base, prefix):
+        self.rnd = rnd
+        self.base = base
+        self.prefix = prefix
+        self.nl = b'\r\n' if rnd.random() < 0.3 else b'\n' # some mods are saved with windows line endings
+
+    def write(self, cat, name, lines):
+        d = os.path.join(self.base, cat)
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, name), 'wb') as f:
+            f.write(self.nl.join(lines) + self.nl)
+
+    def resources(self, n):
+        rnd = self.rnd
+        lines = [b'\tresources = {', b'\t\tcategory = planet_jobs']
+        for _ in range(n):
+            line = b'\t\tproduces = { %s = %d' % (rnd.choice(RESOURCES), rnd.randint(1, 6))
+            if rnd.random() < 0.2:
+                line += b' multiplier = value:%s_mult_%d' % (self.prefix, rnd.randint(0, 3))
+            lines.append(line + b' }')
+        if rnd.random() < 0.7:
+            lines.append(b'\t\tupkeep = { %s = %d } # upkeep' % (rnd.choice(RESOURCES), rnd.randint(1, 3)))
+        lines.append(b'\t}')
+        return lines
+
+    def modifier(self):
+        rnd = self.rnd
+        kind = rnd.choice([b'pop_modifier', b'planet_modifier', b'country_modifier', b'triggered_planet_modifier', b'triggered_pop_modifier'])
+        body = [b'%s = %s' % (rnd.choice(MODIFIERS), rnd.choice([b'1', b'0.05', b'-2', b'@%s_value' % self.prefix]))]
+        if kind.startswith(b'triggered_'):
+            body.insert(0, b'potential = { has_x = yes NOT = { has_y = no } }')
+        if rnd.random() < 0.3:
+            body.insert(0, b'mult = value:%s_scale' % self.prefix)
+        if rnd.random() < 0.2:
+            body = [b'modifier = { %s }' % b' '.join(body)]
+        return [b'\t%s = {' % kind] + [b'\t\t' + x for x in body] + [b'\t}']
+
+    def job(self, name):
+        rnd = self.rnd
+        lines = [b'%s = { # %s' % (name, name), b'\tcategory = %s' % rnd.choice([b'worker', b'specialist', b'ruler'])]
+        if rnd.random() < 0.5:
+            lines.append(b'\ticon = %s' % name)
+        if rnd.random() < 0.05:
+            lines.append(b'\tis_capped_by_modifier = no')
+        lines.append(b'\tpossible = { planet = { has_building = building_%s } }' % name)
+        lines += self.resources(rnd.randint(1, 3))
+        if rnd.random() < 0.1:
+            lines += [b'\toverlord_resources = {', b'\t\tcategory = overlord', b'\t\tproduces = { unity = 1 }', b'\t}']
+        for _ in range(rnd.randint(0, 3)):
+            lines += self.modifier()
+        if rnd.random() < 0.3:
+            lines.append(b'\tinline_script = { script = jobs/%s_weight VALUE = %d }' % (self.prefix, rnd.randint(1, 9)))
+        lines.append(b'\tweight = { weight = @%s_weight modifier = { factor = 0.5 num_pops > 10 } }' % self.prefix)
+        lines.append(b'\tdesc = { text = "%s # not a comment"' % name)
+        lines.append(b'\t}')
+        lines.append(b'}')
+        return lines
+
+    def building(self, name):
+        rnd = self.rnd
+        lines = [b'%s = {' % name, b'\tbase_buildtime = %d' % rnd.randint(100, 900), b'\tcategory = resource']
+        if rnd.random() < 0.1: # few buildings of real mods look at the number of pops
+            count = rnd.choice([b'@%s_pops' % self.prefix, b'@global_pops_%d' % rnd.randint(0, 9)]) if rnd.random() < 0.3 else str(rnd.randint(1, 40)).encode()
+            lines.append(b'\tpotential = { owner = { is_ai = no } %s %s %s }' % (rnd.choice([b'num_pops', b'num_sapient_pops']), rnd.choice(OPERATORS), count))
+        else:
+            lines.append(b'\tpotential = { owner = { is_ai = no } }')
+        if rnd.random() < 0.05:
+            lines.append(b'\tallow = { OR = { num_pops %s %d has_y = no } }' % (rnd.choice(OPERATORS), rnd.randint(1, 40)))
+        lines.append(b'\tupkeep_resources = { %s = %d }' % (rnd.choice(RESOURCES), rnd.randint(1, 5)))
+        # the bulk of a real building: resources, modifiers, descriptions and ai weights
+        lines += [
+            b'\tresources = {',
+            b'\t\tcategory = planet_buildings',
+            b'\t\tcost = { %s = %d }' % (rnd.choice(RESOURCES), rnd.randint(100, 500)),
+            b'\t\tproduces = { %s = %d }' % (rnd.choice(RESOURCES), rnd.randint(1, 8)),
+            b'\t}',
+        ]
+        for _ in range(rnd.randint(1, 4)):
+            lines += [
+                b'\ttriggered_planet_modifier = {',
+                b'\t\tpotential = { exists = owner owner = { has_technology = tech_%s_%d } }' % (self.prefix, rnd.randint(0, 99)),
+                b'\t\tmodifier = { %s = %d }' % (rnd.choice(MODIFIERS), rnd.randint(1, 5)),
+                b'\t}',
+            ]
+        lines += [
+            b'\ttriggered_desc = {',
+            b'\t\ttrigger = { exists = owner owner = { is_regular_empire = yes } }',
+            b'\t\ttext = %s_desc_%d' % (name, rnd.randint(0, 3)),
+            b'\t}',
+            b'\tdestroy_trigger = { exists = owner owner = { NOT = { has_valid_civic = civic_%s } } } # keep in sync' % self.prefix,
+            b'\tai_weight = {',
+            b'\t\tweight = %d' % rnd.randint(0, 100),
+            b'\t\tmodifier = { factor = 0 planet = { free_housing < 2 } }',
+            b'\t}',
+        ]
+        lines.append(b'}')
+        return lines
+
+    def variables(self):
+        return [
+            b'@%s_weight = %d' % (self.prefix, self.rnd.randint(1, 20)),
+            b'@%s_value = %d' % (self.prefix, self.rnd.randint(1, 5)),
+            b'@%s_pops = %d' % (self.prefix, self.rnd.randint(1, 30)),
+        ]
+
+    def inline_scripts(self):
+        prefix = self.prefix.decode()
+        self.write("common/inline_scripts/jobs", '%s_weight.txt' % prefix, [
+            b'# weight bonus of %s' % self.prefix,
+            b'weight_modifier = { factor = $VALUE$ has_x = yes }',
+        ])
+        self.write("common/inline_scripts/jobs", '%s_extra.txt' % prefix, self.job(b'job_%s_inline' % self.prefix))
+
+def chunks(names, per_file):
+    for i in range(0, len(names), per_file):
+        yield names[i:i + per_file]
+
+def generate(root, mods=100, seed=1):
+    """
+    write vanilla to `root/game`, `mods` mods to `root/workshop` and their load order to `root/exported.json`.\n
+    about half of the mods have jobs and buildings, and some of them overwrite vanilla or earlier mods.
+    returns (workshop path, game path, exported json path)
+    """
+    rnd = random.Random(seed)
+    workshop = os.path.join(root, "workshop")
+    game = os.path.join(root, "game")
+    os.makedirs(workshop, exist_ok=True)
+
+    vanilla = ModWriter(rnd, game, b'v')
+    vanilla_jobs = [b'job_v_%d' % i for i in range(150)]
+    vanilla_buildings = [b'building_v_%d' % i for i in range(120)]
+    for i, names in enumerate(chunks(vanilla_jobs, 30)):
+        vanilla.write("common/pop_jobs", '%02d_jobs.txt' % i, vanilla.variables() + sum((vanilla.job(x) for x in names), []))
+    for i, names in enumerate(chunks(vanilla_buildings, 40)):
+        vanilla.write("common/buildings", '%02d_buildings.txt' % i, vanilla.variables() + sum((vanilla.building(x) for x in names), []))
+    vanilla.inline_scripts()
+    vanilla.write("common/scripted_variables", '00_scripted_variables.txt', [b'@global_pops_%d = %d' % (i, rnd.randint(1, 30)) for i in range(10)])
+
+    modids = []
+    all_jobs = list(vanilla_jobs)
+    all_buildings = list(vanilla_buildings)
+    for m in range(mods):
+        modid = str(2000000000 + m)
+        modids.append(modid)
+        mod = ModWriter(rnd, os.path.join(workshop, modid), b'm%d' % m)
+        mod.write(".", "descriptor.mod", [b'name = "synthetic mod %d"' % m, b'supported_version = "3.*"'])
+        if rnd.random() < 0.5:
+            names = [b'job_m%d_%d' % (m, i) for i in range(rnd.randint(1, 40))]
+            names += rnd.sample(all_jobs, min(len(all_jobs), rnd.randint(0, 3))) # overwrites
+            all_jobs += names
+            mod.inline_scripts()
+            for i, part in enumerate(chunks(names, 20)):
+                lines = mod.variables() + sum((mod.job(x) for x in part), [])
+                if rnd.random() < 0.1:
+                    lines.append(b'inline_script = jobs/%s_extra' % mod.prefix)
+                mod.write("common/pop_jobs", '%s_%02d_jobs.txt' % (modid, i), lines)
+        if rnd.random() < 0.4:
+            names = [b'building_m%d_%d' % (m, i) for i in range(rnd.randint(1, 30))]
+            names += rnd.sample(all_buildings, min(len(all_buildings), rnd.randint(0, 3)))
+            all_buildings += names
+            mod.write("common/buildings", '%s_buildings.txt' % modid, mod.variables() + sum((mod.building(x) for x in names), []))
+        if rnd.random() < 0.3:
+            mod.write("common/on_actions", '%s_on_actions.txt' % modid, [b'on_game_start = { events = { %s.1 } }' % mod.prefix])
+
+    # a mod that is installed but not enabled
+    ModWriter(rnd, os.path.join(workshop, "1"), b'disabled').write("common/pop_jobs", 'jobs.txt', [b'job_disabled = { category = worker }'])
+
+    rnd.shuffle(modids)
+    exported_json = os.path.join(root, "exported.json")
+    with open(exported_json, 'w') as f:
+        json.dump({"ModIds": [{"SteamId": x} for x in modids]}, f)
+    return workshop, game, exported_json
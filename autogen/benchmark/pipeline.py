@@ -0,0 +1,67 @@
+"""
+time to the first output byte and peak memory of the generators in patch.py
+
+runs each generator and reports the wall time, the time until the first byte of a patch file is written,
+the number of bytes written, and the peak memory (tracemalloc) during the run.\n
+patch files are not touched: everything `open_output` would write is counted and discarded.\n
+on its own, this runs on the enabled mods of the Steam install (with the parse cache as configured in config.py,
+so run twice to see the numbers with a warm cache):
+
+    python -m benchmark.pipeline [generator ...]
+"""
+
+import sys
+import time
+import tracemalloc
+import contextlib
+
+import patch
+
+class OutputProbe:
+    """
+    stands in for the files opened by `open_output`, and records when the first byte arrives
+    """
+    def __init__(self):
+        self.start = None
+        self.first_byte = None
+        self.size = 0
+
+    def write(self, data):
+        if self.first_byte is None and len(data) > 0:
+            self.first_byte = time.perf_counter() - self.start
+        self.size += len(data)
+        return len(data)
+
+    @contextlib.contextmanager
+    def open_output(self, p):
+        yield self
+
+def run(name, f, corpus):
+    """
+    run the generator `f` on `corpus`. returns a dict of the numbers described above
+    """
+    probe = OutputProbe()
+    open_output = patch.open_output
+    patch.open_output = probe.open_output
+    try:
+        tracemalloc.start()
+        probe.start = time.perf_counter()
+        f(corpus)
+        elapsed = time.perf_counter() - probe.start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        patch.open_output = open_output
+    return {'time': elapsed, 'first_byte': probe.first_byte, 'written': probe.size, 'peak_memory': peak}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(patch.generators.keys())
+    results = []
+    with contextlib.redirect_stdout(None):
+        corpus = patch.ModCorpus()
+        for name in names:
+            results.append((name, run(name, patch.generators[name][0], corpus)))
+        patch.parse_cache.save()
+    for name, r in results:
+        print('%s: %.3fs, first byte after %s, %.1f kB written, peak %.1f MB' % (
+            name, r['time'], '%.3fs' % r['first_byte'] if r['first_byte'] is not None else '-', r['written'] / 1e3, r['peak_memory'] / 1e6))
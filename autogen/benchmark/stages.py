@@ -0,0 +1,110 @@
+"""
+timings of the separate stages of patch.py on the enabled mods of `patch.env`
+
+    tokenize  ... `get_segments_complex` on the contents of every script file (already in memory)
+    prefilter ... the parsers of `patch.category_parsers` on the files of their categories
+    split3    ... splitting each parsed file, and the value of each of its entries, as `split3` does
+    transform ... the generators themselves, with the parsed trees already loaded, minus the time spent in `write_fields`
+    export    ... `export_fields` on each parsed file
+
+the parse cache is not used. each stage is run `repeat` times and the best time is kept
+"""
+
+import time
+import contextlib
+
+import patch
+
+def best_of(repeat, f):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        f()
+        t = time.perf_counter() - t
+        best = t if best is None or t < best else best
+    return best
+
+def read_all(corpus, cats):
+    """
+    list of (category, contents) of all the script files
+    """
+    out = []
+    for modid in corpus.modids:
+        for cat in cats:
+            for p in corpus.scripts(modid, cat):
+                with open(p, 'rb') as f:
+                    out.append((cat, f.read()))
+    return out
+
+def time_generator(corpus, f):
+    """
+    returns (total time, time spent in `write_fields`) of the generator `f`
+    """
+    spent = [0.0]
+    write_fields = patch.write_fields
+    open_output = patch.open_output
+    def timed_write_fields(f, target):
+        t = time.perf_counter()
+        write_fields(f, target)
+        spent[0] += time.perf_counter() - t
+    patch.write_fields = timed_write_fields
+    patch.open_output = lambda p: contextlib.nullcontext(NullOutput())
+    try:
+        t = time.perf_counter()
+        f(corpus)
+        return time.perf_counter() - t, spent[0]
+    finally:
+        patch.write_fields = write_fields
+        patch.open_output = open_output
+
+class NullOutput:
+    def write(self, data):
+        return len(data)
+
+def measure(repeat=3):
+    """
+    returns a dict of stage name -> seconds, and a dict of corpus statistics
+    """
+    cats = sorted(set(c for x in patch.generators.values() for c in x[1]))
+    corpus = patch.ModCorpus()
+    contents = read_all(corpus, cats)
+    trees = [patch.get_segments_complex(x) for _, x in contents]
+    prefiltered = [(patch.category_parsers[cat], x) for cat, x in contents if cat in patch.category_parsers]
+
+    # `make_fields` directly, as `split3` would hit the cache of each `Block` from the second round on
+    def split_all():
+        for tree in trees:
+            for entry in patch.process_inline(patch.make_fields(tree), patch.InlineOption.Substitute):
+                if isinstance(entry[2], list):
+                    patch.process_inline(patch.make_fields(entry[2]), patch.InlineOption.DoNothing)
+
+    stages = {}
+    stages['tokenize'] = best_of(repeat, lambda: [patch.get_segments_complex(x) for _, x in contents])
+    stages['prefilter'] = best_of(repeat, lambda: [f(x) for f, x in prefiltered])
+    stages['split3'] = best_of(repeat, split_all)
+    stages['export'] = best_of(repeat, lambda: [patch.export_fields(x) for x in trees])
+
+    # load every tree once, so that the generators do not parse
+    for modid in corpus.modids:
+        for cat in cats:
+            for p in corpus.scripts(modid, cat):
+                corpus.parse(p, corpus.parser(cat))
+    for name, (f, _, _, _) in patch.generators.items():
+        best = None
+        for _ in range(repeat):
+            total, export = time_generator(corpus, f)
+            if best is None or total < best[0]:
+                best = (total, export)
+        stages['transform_%s' % name] = best[0] - best[1]
+        stages['export_%s' % name] = best[1]
+
+    statistics = {
+        'mods': len(corpus.modids) - 1,
+        'files': len(contents),
+        'bytes': sum(len(x) for _, x in contents),
+        'tokens': sum(count_tokens(x) for x in trees),
+    }
+    return stages, statistics
+
+def count_tokens(tree):
+    return sum(count_tokens(x) if isinstance(x, list) else 1 for x in tree)
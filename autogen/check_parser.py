@@ -0,0 +1,195 @@
+"""
+parity check for the parsers in patch.py
+
+compares `get_segments_complex` / `get_segments_simple` against their old byte-at-a-time versions
+on every `common/**/*.txt` file of vanilla, or of the directories given as command line arguments,
+and prints the time spent by each of them, and the memory taken by the parsed trees.\n
+`get_segments_lazy` is compared against `get_segments_complex` (the comparison tokenizes all of its blocks).\n
+also checks that `get_segments_prefiltered` only leaves out entries that do not mention `prefilter_keywords`,
+including in files with bare `\r` line breaks.
+
+usage: python check_parser.py [dir ...]
+"""
+
+import os
+import glob
+import sys
+import time
+import tracemalloc
+
+from patch import *
+
+def get_segments_complex_legacy(scr):
+    """
+    old byte-at-a-time implementation of `get_segments_complex`. kept as the reference for `check`
+    """
+    comment = False
+    current_ptr = []
+    parent_ptrs = []
+    result = current_ptr
+    separation = False
+    eq_no_separate = False
+    
+    for char in scr:
+        char = char.to_bytes(1, 'big')
+        match char:
+            case b'{':
+                if not comment:
+                    parent_ptrs.append(current_ptr)
+                    x = []
+                    current_ptr.append(x)
+                    current_ptr = x
+            case b'}':
+                if not comment:
+                    current_ptr = parent_ptrs.pop()
+            case b'#':
+                comment = True
+            case b'\n' | b'\r' | b' ' | b'\t' | b'\f' | b'\v':
+                if char == b'\n' or char == b'\r':
+                    comment = False
+                if comment == False:
+                    separation = True
+            case x:
+                if not comment:
+                    if x == b'=' and not eq_no_separate:
+                        separation = True
+                    if eq_no_separate:
+                        eq_no_separate = False
+                    if x == b'>' or x == b'<' or x == b'!':
+                        eq_no_separate = True
+                    if len(current_ptr) == 0:
+                        current_ptr.append(x)
+                    elif isinstance(current_ptr[-1], list):
+                        current_ptr.append(x)
+                    elif separation:
+                        current_ptr.append(x)
+                    elif isinstance(current_ptr[-1], bytes):
+                        current_ptr[-1] += x
+                    else:
+                        raise NotImplementedError('not implemented case')
+                    if x != b'=':
+                        separation = False
+
+    return result
+
+def get_segments_simple_legacy(scr):
+    """
+    old byte-at-a-time implementation of `get_segments_simple`. kept as the reference for `check`
+    """
+    result = []
+    first_bracket_arrived = False
+    comment = False
+    nest = 0
+    segment = b""
+    for char in scr:
+        char = char.to_bytes(1, 'big')
+        match char:
+            case b'{':
+                if not comment:
+                    nest += 1
+                    first_bracket_arrived = True
+            case b'}':
+                if not comment:
+                    nest -= 1
+            case b'#':
+                comment = True
+            case b'\n':
+                comment = False
+        segment += char
+        if first_bracket_arrived and nest == 0:
+            result.append(segment)
+            segment = b""
+            first_bracket_arrived = False
+    return result
+
+def check(paths, name, f, f_legacy):
+    failed = 0
+    t_new = 0
+    t_old = 0
+    for p in paths:
+        with open(p, 'rb') as fp:
+            scr = fp.read()
+        t = time.perf_counter()
+        try:
+            a = f_legacy(scr)
+        except Exception as e:
+            a = e.__class__
+        t_old += time.perf_counter() - t
+        t = time.perf_counter()
+        try:
+            b = f(scr)
+        except Exception as e:
+            b = e.__class__
+        t_new += time.perf_counter() - t
+        if a != b:
+            print('MISMATCH %s: %s' % (name, p))
+            failed += 1
+    print('%s: %s files, %s mismatches, legacy %.3fs -> %.3fs' % (name, len(paths), failed, t_old, t_new))
+    return failed
+
+# bare `\r` line breaks end comments in complex mode but not in simple mode, and cutting segments the simple way
+# would end `building_a` at the `}` right after the comment that runs up to `\n`
+prefilter_bare_cr = b'@x = 3\rbuilding_a = { # x\r    allow = { num_pops > 3 # }\n    }\r}\nbuilding_b = { # }\r    potential = { always = yes }\r}\r'
+
+def prefilter_inputs(paths):
+    """
+    (name, script) of the files at `paths` and of their copies with bare `\r` line breaks, then `prefilter_bare_cr`
+    """
+    for p in paths:
+        with open(p, 'rb') as fp:
+            scr = fp.read()
+        yield p, scr
+        yield p + ' (bare CR)', scr.replace(b'\r\n', b'\n').replace(b'\n', b'\r')
+    yield 'prefilter_bare_cr', prefilter_bare_cr
+
+def check_prefilter(paths):
+    failed = 0
+    skipped = 0
+    for p, scr in prefilter_inputs(paths):
+        try:
+            full = make_fields(get_segments_complex(scr))
+        except Exception:
+            continue
+        try:
+            prefiltered = make_fields(get_segments_prefiltered(scr))
+            assert len(full) == len(prefiltered)
+        except Exception:
+            print('MISMATCH prefiltered: %s' % p)
+            failed += 1
+            continue
+        for a, b in zip(full, prefiltered):
+            if a == b:
+                continue
+            if a[0] == b[0] and b[2] == [] and not nestedSearchList(list(a), lambda x: any(k in x for k in prefilter_keywords)):
+                skipped += 1
+                continue
+            print('MISMATCH prefiltered: %s %s' % (p, a[0]))
+            failed += 1
+    print('prefiltered: %s files (also with bare CR line breaks), %s entries left out, %s mismatches' % (len(paths), skipped, failed))
+    return failed
+
+def measure_memory(paths, name, f):
+    """
+    parse all the files and keep the trees alive, as `ModCorpus` users do
+    """
+    trees = []
+    tracemalloc.start()
+    for p in paths:
+        with open(p, 'rb') as fp:
+            trees.append(f(fp.read()))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%s: parsed trees take %.1f MB (peak %.1f MB)' % (name, current / 1e6, peak / 1e6))
+
+if __name__ == "__main__":
+    dirs = sys.argv[1:] or [env.stellaris_game_path]
+    paths = sorted(itertools.chain.from_iterable(glob.glob(os.path.join(d, "common/**/*.txt"), recursive=True) for d in dirs))
+    failed = check(paths, 'complex', get_segments_complex, get_segments_complex_legacy)
+    failed += check(paths, 'simple', get_segments_simple, get_segments_simple_legacy)
+    failed += check(paths, 'lazy', get_segments_lazy, get_segments_complex)
+    failed += check_prefilter(paths)
+    measure_memory(paths, 'complex legacy', get_segments_complex_legacy)
+    measure_memory(paths, 'complex', get_segments_complex)
+    measure_memory(paths, 'complex (shared symbol table)', lambda scr: get_segments_complex(scr, symbol_table))
+    measure_memory(paths, 'lazy (not accessed)', get_segments_lazy)
+    sys.exit(1 if failed else 0)
@@ -6,31 +6,7 @@ import os
 import platform
 import json
 import glob
-
-with open(
-    os.path.join(os.path.dirname(os.path.abspath(__file__)), "exported.json")
-) as f:
-    mod_load_list_json = json.load(f)
-
-if platform.system() == "Windows":
-    stellaris_path = "C:/Program Files (x86)/Steam/steamapps/workshop/content/281990/"
-elif platform.system() == "Linux":
-    stellaris_path = (
-        os.environ["HOME"] + "/.local/share/Steam/steamapps/workshop/content/281990/"
-    )
-
-if platform.system() == "Windows":
-    stellaris_game_path = "C:/Program Files (x86)/Steam/steamapps/common/Stellaris/"
-elif platform.system() == "Linux":
-    stellaris_game_path = (
-        os.environ["HOME"] + "/.local/share/Steam/steamapps/common/Stellaris/"
-    )
-
-mod_installed = set(
-    [os.path.basename(x) for x in glob.glob(os.path.join(stellaris_path, "*"))]
-)
-mod_order = [str(i["SteamId"]) for i in mod_load_list_json["ModIds"] if i["SteamId"]]
-mod_loaded = set(mod_order)
+import functools
 
 file_prefix = "zzzzzzzzzzzzzzzzzzzz_"  # file prefix for autogenerated files
 
@@ -39,15 +15,85 @@ mr_modid = "2807759164"  # Merger of Rules modid
 aup_modid = "1995601384"  # unofficial patch
 giga_modid = "1121692237"  # gigastructure
 
-# Default mod excludes
-mod_excludes = list(mod_installed - mod_loaded)
-
-mod_excludes += [
+# mods excluded on top of the installed but not loaded ones
+extra_mod_excludes = [
     "2529002857",  # production revolution SHOULD BE DISABLED
     "2830366252",  # production revolution patch SHOULD BE DISABLED
     "2466607238",  # Kasako framework SHOULD BE DISABLED
 ]
 
+class ModEnvironment:
+    """
+    paths and mod lists of the local Stellaris install.\n
+    nothing is read from disk until an attribute is used for the first time, and each value is computed only once.\n
+    the paths can be overridden by the arguments, or by the environment variables
+    `MYCOMPAT_WORKSHOP_PATH`, `MYCOMPAT_GAME_PATH` and `MYCOMPAT_EXPORTED_JSON`.
+    """
+    def __init__(self, workshop_path=None, game_path=None, exported_json=None):
+        self.workshop_path = workshop_path or os.environ.get("MYCOMPAT_WORKSHOP_PATH")
+        self.game_path = game_path or os.environ.get("MYCOMPAT_GAME_PATH")
+        self.exported_json = exported_json or os.environ.get("MYCOMPAT_EXPORTED_JSON") or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "exported.json"
+        )
+
+    @functools.cached_property
+    def stellaris_path(self):
+        if self.workshop_path:
+            return self.workshop_path
+        if platform.system() == "Windows":
+            return "C:/Program Files (x86)/Steam/steamapps/workshop/content/281990/"
+        elif platform.system() == "Linux":
+            return os.environ["HOME"] + "/.local/share/Steam/steamapps/workshop/content/281990/"
+        raise RuntimeError("unknown platform, please set MYCOMPAT_WORKSHOP_PATH")
+
+    @functools.cached_property
+    def stellaris_game_path(self):
+        if self.game_path:
+            return self.game_path
+        if platform.system() == "Windows":
+            return "C:/Program Files (x86)/Steam/steamapps/common/Stellaris/"
+        elif platform.system() == "Linux":
+            return os.environ["HOME"] + "/.local/share/Steam/steamapps/common/Stellaris/"
+        raise RuntimeError("unknown platform, please set MYCOMPAT_GAME_PATH")
+
+    @functools.cached_property
+    def mod_load_list_json(self):
+        with open(self.exported_json) as f:
+            return json.load(f)
+
+    @functools.cached_property
+    def mod_installed(self):
+        return set(
+            [os.path.basename(x) for x in glob.glob(os.path.join(self.stellaris_path, "*"))]
+        )
+
+    @functools.cached_property
+    def mod_order(self):
+        return [str(i["SteamId"]) for i in self.mod_load_list_json["ModIds"] if i["SteamId"]]
+
+    @functools.cached_property
+    def mod_rank(self):
+        """
+        position of each mod in `mod_order`
+        """
+        rank = {}
+        for i, m in enumerate(self.mod_order):
+            rank.setdefault(m, i)
+        return rank
+
+    @functools.cached_property
+    def mod_loaded(self):
+        return set(self.mod_order)
+
+    @functools.cached_property
+    def mod_excludes(self):
+        """
+        installed but not loaded mods, and `extra_mod_excludes`
+        """
+        return (self.mod_installed - self.mod_loaded) | set(extra_mod_excludes)
+
+env = ModEnvironment()
+
 # +++++++++++++++++ #
 # PLEASE EDIT BELOW #
 # +++++++++++++++++ #
@@ -55,3 +101,5 @@ mod_excludes += [
 job_excludes = [b"dummicist", b"matter_reanimator"]
 
 AOT = False
+
+PARSE_CACHE = True # keep parsed scripts in autogen/parse_cache.pickle and only parse changed files again
@@ -6,8 +6,23 @@ import re
 
 import itertools
 
-import functools
 import sys
+import contextlib
+
+import pickle
+import mmap
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import shutil
+import tempfile
+import fnmatch
+import collections
+import time
+import threading
+import cProfile
+import gc
 
 from config import *
 
@@ -17,13 +32,25 @@ from config import *
 #
 #######
 
+@contextlib.contextmanager
+def map_file(fp):
+    """
+    map the opened file `fp` into memory (read-only), so that the parsers can scan it without copying it into a bytes object.\n
+    the map is released when leaving the `with` block. empty files, which cannot be mapped, give `b''`
+    """
+    if os.fstat(fp.fileno()).st_size == 0:
+        yield b''
+    else:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            yield m
+
 def get_scripts_from_category_p(game_path, modid, cat):
-    paths = get_scripts(game_path, modid, "%s/*.txt" % cat)
-    result = []
-    for p in paths:
-        with open(p, 'rb') as f:
-            result.append([p, f.read()])
-    return result
+    """
+    same as `get_scripts_from_category`, but yields `[path, contents]`
+    """
+    for p in get_scripts(game_path, modid, "%s/*.txt" % cat):
+        with open(p, 'rb') as fp, map_file(fp) as scr:
+            yield [p, scr]
 
 def get_segments_from_category_p(game_path, modid, cat, simple=False):
     """
@@ -47,16 +74,17 @@ def get_segments_from_category_p(game_path, modid, cat, simple=False):
         f = get_segments_simple
     else:
         f = get_segments_complex
-    return list(itertools.chain.from_iterable(map(lambda x: [x[0], f(x[1])], get_scripts_from_category_p(game_path, modid, cat))))
+    return list(itertools.chain.from_iterable(map(lambda p: [p, parse_script_file(p, f)], get_scripts(game_path, modid, "%s/*.txt" % cat))))
 
 
 def get_scripts_from_category(game_path, modid, cat):
-    paths = get_scripts(game_path, modid, "%s/*.txt" % cat)
-    result = []
-    for p in paths:
-        with open(p, 'rb') as f:
-            result.append(f.read())
-    return result
+    """
+    yield the contents of all txt files under `game_path/modid/cat`, one file at a time.\n
+    each file is memory-mapped, and released as soon as the next one is requested, so do not keep the yielded objects around
+    """
+    for p in get_scripts(game_path, modid, "%s/*.txt" % cat):
+        with open(p, 'rb') as fp, map_file(fp) as scr:
+            yield scr
 
 def get_segments_from_category(game_path, modid, cat, simple=False):
     """
@@ -80,10 +108,59 @@ def get_segments_from_category(game_path, modid, cat, simple=False):
         f = get_segments_simple
     else:
         f = get_segments_complex
-    return list(itertools.chain.from_iterable(map(f, get_scripts_from_category(game_path, modid, cat))))
+    return list(itertools.chain.from_iterable(map(lambda p: parse_script_file(p, f), get_scripts(game_path, modid, "%s/*.txt" % cat))))
 
 def get_scripts(game_path, modid, query):
-    return list(glob.glob(os.path.join(game_path, modid, query)))
+    """
+    lazily yield the paths matching `game_path/modid/query`.\n
+    the usual `category/*.txt` queries are answered from `script_index`, other ones are globbed
+    """
+    cat, pattern = query.rsplit('/', 1)
+    if pattern == '*.txt' and not any(c in cat for c in '*?['):
+        return iter(script_index.scripts(os.path.join(game_path, modid), cat))
+    return glob.iglob(os.path.join(game_path, modid, query))
+
+def scan_scripts(d):
+    """
+    paths of the txt files directly under the directory `d`. same result (and order) as `glob.glob(os.path.join(d, "*.txt"))`,
+    but takes a single `os.scandir` call. a missing directory gives an empty list
+    """
+    try:
+        with os.scandir(d) as it:
+            return [os.path.join(d, e.name) for e in it if not e.name.startswith('.') and fnmatch.fnmatch(e.name, '*.txt')]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+def read_script_file(p):
+    """
+    read the whole file at `p`. returns (mtime_ns, size, contents)
+    """
+    with open(p, 'rb') as fp:
+        st = os.fstat(fp.fileno())
+        return (st.st_mtime_ns, st.st_size, fp.read())
+
+def bounded_map(ex, f, items, window):
+    """
+    same as `ex.map(f, items)`, but at most `window` calls are submitted ahead of the one the consumer is waiting for,
+    so that the results do not pile up in memory when the consumer is slower than the executor
+    """
+    pending = collections.deque()
+    for x in items:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(ex.submit(f, x))
+    while pending:
+        yield pending.popleft().result()
+
+def parse_script_file(p, f):
+    """
+    read the file at `p` and parse it with `f` (`get_segments_simple` or `get_segments_complex`).
+    goes through `parse_cache` if `PARSE_CACHE` is enabled in config.py
+    """
+    if PARSE_CACHE:
+        return parse_cache.parse(p, f)
+    with open(p, 'rb') as fp, map_file(fp) as scr:
+        return f(scr)
 
 from enum import Enum
 
@@ -93,17 +170,19 @@ class InlineOption(Enum):
     Functional = 3
     DoNothing = 4
 
-# TODO: implement inline script
 def process_inline(spl, inline_option):
     inlines = list(filter(lambda x: x[0] == b'inline_script', spl))
     if len(inlines) > 0:
         print("WARNING!!!! inline script!!!!!!!")
         match inline_option:
             case InlineOption.Trim:
-                return list(filter(lambda x: x[0] != b'inline_script', spl))
+                return Fields(filter(lambda x: x[0] != b'inline_script', spl))
             case InlineOption.Substitute:
-                print("WARNING@@@@!@!@!! not implemented but contnuing anyway (as Trim option)!!!!!")
-                return list(filter(lambda x: x[0] != b'inline_script', spl))
+                if inline_scripts.corpus is None:
+                    # no `ModCorpus` to look the templates up in, such as with `get_segments_from_category`
+                    print("WARNING: no mod corpus to expand inline scripts with, continuing anyway (as Trim option)")
+                    return Fields(filter(lambda x: x[0] != b'inline_script', spl))
+                return inline_scripts.expand(spl)
             case InlineOption.Functional:
                 raise NotImplementedError("not implemented")
             case InlineOption.DoNothing:
@@ -112,105 +191,716 @@ def process_inline(spl, inline_option):
     else:
         return spl
 
-def get_segments_complex(scr):
-    comment = False
+# tokens for get_segments_complex. each match is an optional run of whitespace followed by one of
+#   group 2 ... run of ordinary bytes (behaves exactly like a single byte in the old byte-at-a-time loop)
+#   (none)  ... comment up to (but not including) the end of line
+#   group 3 ... one of `{`, `}`, `=`, `<`, `>`, `!`
+complex_token_re = re.compile(rb'(\s+)?(?:([^\s{}#=<>!]+)|#[^\r\n]*|([{}=<>!]))')
+
+def get_segments_complex(scr, symbols=None):
+    """
+    complex mode parser. see `get_segments_from_category` for the output format.\n
+    same output as `get_segments_complex_legacy` (in check_parser.py), but scans the script with a compiled regex instead of byte by byte.\n
+    equal tokens share a single bytes object, registered in the symbol table `symbols`.
+    by default the table is local to this script. pass `symbol_table` to share tokens with other scripts and with the constants in this file.
+    """
     current_ptr = []
     parent_ptrs = []
     result = current_ptr
     separation = False
     eq_no_separate = False
-    
-    for char in scr:
-        char = char.to_bytes(1, 'big')
-        match char:
-            case b'{':
-                if not comment:
-                    parent_ptrs.append(current_ptr)
-                    x = []
-                    current_ptr.append(x)
-                    current_ptr = x
-            case b'}':
-                if not comment:
-                    current_ptr = parent_ptrs.pop()
-            case b'#':
-                comment = True
-            case b'\n' | b'\r' | b' ' | b'\t' | b'\f' | b'\v':
-                if char == b'\n' or char == b'\r':
-                    comment = False
-                if comment == False:
-                    separation = True
-            case x:
-                if not comment:
-                    if x == b'=' and not eq_no_separate:
-                        separation = True
-                    if eq_no_separate:
-                        eq_no_separate = False
-                    if x == b'>' or x == b'<' or x == b'!':
-                        eq_no_separate = True
-                    if len(current_ptr) == 0:
-                        current_ptr.append(x)
-                    elif isinstance(current_ptr[-1], list):
-                        current_ptr.append(x)
-                    elif separation:
-                        current_ptr.append(x)
-                    elif isinstance(current_ptr[-1], bytes):
-                        current_ptr[-1] += x
-                    else:
-                        raise NotImplementedError('not implemented case')
-                    if x != b'=':
-                        separation = False
+    if symbols is None:
+        symbols = {}
+    intern = symbols.setdefault
+    # `Block`s cannot be modified once made. they are filled here with the methods of `list`
+    append = list.append
+    setitem = list.__setitem__
+
+    for ws, x, sp in complex_token_re.findall(scr):
+        if ws:
+            separation = True
+        if sp:
+            x = sp
+            if x == b'{':
+                parent_ptrs.append(current_ptr)
+                y = Block()
+                append(current_ptr, y)
+                current_ptr = y
+                continue
+            elif x == b'}':
+                current_ptr = parent_ptrs.pop()
+                continue
+            if x == b'=' and not eq_no_separate:
+                separation = True
+        elif not x:
+            # comment
+            continue
+        if eq_no_separate:
+            eq_no_separate = False
+        if x == b'>' or x == b'<' or x == b'!':
+            eq_no_separate = True
+        if separation or not current_ptr or isinstance(current_ptr[-1], list):
+            append(current_ptr, intern(x, x))
+        else:
+            y = current_ptr[-1] + x
+            setitem(current_ptr, -1, intern(y, y))
+        if x != b'=':
+            separation = False
 
     return result
 
+# symbol table shared by the whole corpus (see `get_segments_complex` and `intern_tree`).
+# it is seeded with the keys that the generators look for. since equal bytes literals in this file are a single constant,
+# tokens interned here are the very same objects as those literals, and comparing them ends at the identity check.
+symbol_table = {}
+for x in [
+    b'=', b'>=', b'<=', b'<', b'>', b'!=',
+    b'inline_script', b'num_pops', b'num_sapient_pops',
+    b'possible', b'planet', b'is_capped_by_modifier', b'no', b'yes', b'icon',
+    b'overlord_resources', b'resources', b'produces', b'upkeep', b'multiplier', b'category',
+    b'pop_modifier', b'planet_modifier', b'country_modifier', b'triggered_pop_modifier', b'triggered_planet_modifier', b'triggered_country_modifier',
+    b'modifier', b'mult', b'potential',
+]:
+    symbol_table[x] = x
+
+eq_like_tokens = frozenset([b'=', b'>=', b'<=', b'<', b'>', b'!='])
+
 def is_eq_like(c):
-    return c == b'=' or c == b'>=' or c == b'<=' or c == b'<' or c == b'>' or c == b'!='
+    return c.__class__ is bytes and c in eq_like_tokens
 
-def split3(target, inline_option):
+def intern_tree(tree, symbols):
     """
-    Splits target into a list of length-3 lists.\n
-    Asserts that `len(target) % 3 == 0` and the middle element of each list is '=' or ''!=' or '>=' and so on.\n
-    Useful for additional parsing after finishing complex mode parsing
+    copy of `tree` (output of `get_segments_complex`) whose tokens are registered in the symbol table `symbols`.\n
+    used for trees that come out of a pickle, where the sharing with `symbol_table` is lost
+    """
+    out = tree.__class__()
+    intern = symbols.setdefault
+    append = list.append
+    for x in tree:
+        if x.__class__ is bytes:
+            append(out, intern(x, x))
+        elif x.__class__ is LazyBlock:
+            append(out, x) # interned when tokenized
+        else:
+            append(out, intern_tree(x, symbols))
+    return out
+
+class Fields(list):
+    """
+    output of `split3`: a list of `(name, op, value)` entries.\n
+    keeps a table from each name to its first entry, built on the first lookup and dropped whenever the list is modified
+    """
+    __slots__ = ('first',)
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.first = None
+
+    def __reduce__(self):
+        return (self.__class__, (), None, iter(self))
+
+    def field(self, name):
+        """
+        value of the first entry named `name`, or None
+        """
+        if self.first is None:
+            first = {}
+            for x in self:
+                first.setdefault(x[0], x)
+            self.first = first
+        x = self.first.get(name)
+        return None if x is None else x[2]
+
+    def copy(self):
+        out = self.__class__(self)
+        out.first = self.first
+        return out
+
+class Block(list):
+    """
+    parsed body of `{ ... }`. a plain list of tokens (so it is exported as is by `export_fields`),
+    which also caches its `split3` result as `Fields`.\n
+    blocks are never modified once made, so that parsed trees can be shared by all the generators (see `ModCorpus`).
+    an edit makes a new block that shares everything else with the old one: see `replace_tokens`, `join_fields` and `add_to_field`.\n
+    blocks read by `get_segments_lazy` also keep where they come from in the script (`span`, as `(LazySource, start, end)`)
+    """
+    __slots__ = ('fields_cache', 'span')
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.fields_cache = None
+        self.span = None
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def fields(self):
+        """
+        entries of this block, same as `split3(self, InlineOption.DoNothing)` but shared among the callers.
+        DO NOT modify the returned list
+        """
+        if self.fields_cache is None:
+            self.fields_cache = make_fields(self)
+        return self.fields_cache
+
+    def field(self, name):
+        """
+        value of the first entry named `name`, or None
+        """
+        return self.fields().field(name)
+
+def _list_modifier(cls, attr, name):
+    f = getattr(list, name)
+    def modifier(self, *args):
+        setattr(self, attr, None)
+        return f(self, *args)
+    modifier.__name__ = name
+    setattr(cls, name, modifier)
+
+def _block_modifier(name):
+    def modifier(self, *args):
+        raise TypeError("blocks of parsed trees are shared and cannot be modified. make a new one with `replace_tokens` / `join_fields` instead")
+    modifier.__name__ = name
+    setattr(Block, name, modifier)
+
+for name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend', 'insert', 'pop', 'remove', 'clear', 'sort', 'reverse']:
+    _list_modifier(Fields, 'first', name)
+    _block_modifier(name)
+
+class LazyBlock(Block):
+    """
+    `Block` made by `get_segments_lazy`, that only keeps the range of the script between its braces (`span`).
+    it is tokenized on first access (its own blocks being lazy again), and then it turns into a plain `Block` with the same span
+    """
+    __slots__ = () # same layout as `Block`, so that `__class__` can be switched
+
+    def __init__(self, source, start, end):
+        Block.__init__(self)
+        self.span = (source, start, end)
+
+    def __reduce__(self):
+        return (LazyBlock, self.span)
+
+    def force(self):
+        """
+        tokenize the range into this block
+        """
+        source, start, end = self.span
+        self.__class__ = Block
+        list.extend(self, source.tokenize(start, end, symbol_table))
+
+def _lazy_accessor(name, compare=False):
+    def accessor(self, *args):
+        if compare and not isinstance(args[0], list):
+            return NotImplemented # such as `x != None`, which does not need the tokens
+        self.force()
+        for x in args:
+            # list methods look into the storage of another list directly
+            if x.__class__ is LazyBlock:
+                x.force()
+        return getattr(self, name)(*args)
+    accessor.__name__ = name
+    setattr(LazyBlock, name, accessor)
+
+for name in ['__eq__', '__ne__', '__lt__', '__le__', '__gt__', '__ge__']:
+    _lazy_accessor(name, True)
+
+for name in [
+    '__iter__', '__reversed__', '__len__', '__getitem__', '__contains__', '__repr__', '__sizeof__', '__add__', '__radd__', '__mul__', '__rmul__',
+    'index', 'count', 'copy', 'fields', 'field',
+]:
+    _lazy_accessor(name)
+
+def make_fields(target):
+    """
+    split `target` into `(name, op, value)` tuples, taken directly from the token list without slicing it
     """
     assert len(target) % 3 == 0
-    out = [target[i:i+3] for i in range(0, len(target), 3)]
+    it = iter(target)
+    out = Fields(zip(it, it, it))
     assert all([is_eq_like(x[1]) for x in out])
+    return out
+
+def split3(target, inline_option):
+    """
+    Splits target into a list of length-3 tuples.\n
+    Asserts that `len(target) % 3 == 0` and the middle element of each list is '=' or ''!=' or '>=' and so on.\n
+    Useful for additional parsing after finishing complex mode parsing\n
+    The result is `Fields`, so `get_field` on it is a table lookup. For `Block`s, the splitting itself is cached too
+    """
+    if isinstance(target, Block):
+        out = target.fields().copy()
+    else:
+        out = make_fields(target)
     return process_inline(out, inline_option)
 
+# braces for get_segments_simple. comments are matched as a whole so that braces within them are skipped
+simple_brace_re = re.compile(rb'#[^\n]*|[{}]')
+
 def get_segments_simple(scr):
+    """
+    simple mode parser. see `get_segments_from_category` for the output format.\n
+    same output as `get_segments_simple_legacy` (in check_parser.py), but only looks at braces and comments,
+    and cuts each segment out of `scr` as a single slice
+    """
+    return cut_segments(scr, simple_brace_re)
+
+def cut_segments(scr, brace_re):
+    """
+    top-level `... { ... }` segments of `scr`, as slices of it. `brace_re` matches the braces and the comments, within which braces are skipped
+    """
     result = []
     first_bracket_arrived = False
-    comment = False
     nest = 0
-    segment = b""
-    for char in scr:
-        char = char.to_bytes(1, 'big')
-        match char:
+    start = 0
+    for m in brace_re.finditer(scr):
+        match m.group():
             case b'{':
-                if not comment:
-                    nest += 1
-                    first_bracket_arrived = True
+                nest += 1
+                first_bracket_arrived = True
             case b'}':
-                if not comment:
-                    nest -= 1
-            case b'#':
-                comment = True
-            case b'\n':
-                comment = False
-        segment += char
+                nest -= 1
+            case _:
+                continue
         if first_bracket_arrived and nest == 0:
-            result.append(segment)
-            segment = b""
+            end = m.end()
+            result.append(scr[start:end])
+            start = end
             first_bracket_arrived = False
     return result
 
+# raw bytes that make `get_segments_prefiltered` parse a top-level segment in full
+prefilter_keywords = (b'num_pops', b'num_sapient_pops', b'inline_script')
+# plain `name = ` before the first `{` of a segment
+prefilter_head_re = re.compile(rb'\s*([^\s{}#=<>!]+)\s*=\s*')
+# braces for get_segments_prefiltered. comments end as in `complex_token_re` (at `\r` too, unlike in `simple_brace_re`),
+# so that segments are cut where the complex parser closes the blocks
+prefilter_brace_re = re.compile(rb'#[^\r\n]*|[{}]')
+
+def get_segments_prefiltered(scr):
+    """
+    complex mode parser for files of which only a few top-level entries matter (see `all_buildings`).\n
+    the file is cut into top-level segments as in simple mode (but with comments ending as in complex mode), and only the segments that contain one of `prefilter_keywords`
+    anywhere in their raw bytes are parsed in full. any other segment gives `name = { }` (an empty `Block`), so that its name is
+    still seen by the overwrite resolution. `@variable` definitions and whatever else lies between the segments are kept
+    """
+    result = []
+    pos = 0
+    for seg in cut_segments(scr, prefilter_brace_re):
+        pos += len(seg)
+        if not any(k in seg for k in prefilter_keywords):
+            m = prefilter_head_re.fullmatch(seg, 0, seg.find(b'{'))
+            if m:
+                result += [m.group(1), b'=', Block()]
+                continue
+            # comments or variables before the name
+            head = None
+            for m in prefilter_brace_re.finditer(seg):
+                if m.group() == b'{':
+                    head = get_segments_complex(seg[:m.start()])
+                    break
+            if head is not None and len(head) >= 2 and is_eq_like(head[-1]):
+                result += head
+                result.append(Block())
+                continue
+        result += get_segments_complex(seg)
+    result += get_segments_complex(scr[pos:])
+    return result
+
+# `<`, `>` or `!` right before a brace. the tokenizer state they leave goes across the brace, which `get_segments_lazy` does not follow
+lazy_unsafe_re = re.compile(rb'[<>!](?:\s|#[^\r\n]*)*[{}]')
+# braces for get_segments_lazy. comments end as in `complex_token_re`
+lazy_brace_re = re.compile(rb'#[^\r\n]*|[{}]')
+
+class LazySource:
+    """
+    script of the `LazyBlock`s made by `get_segments_lazy`.\n
+    `children` maps the start of each block (0 for the whole script) to `[start, end, start, end, ...]` of the blocks right inside it
+    """
+    __slots__ = ('data', 'children')
+
+    def __init__(self, data, children):
+        self.data = data
+        self.children = children
+
+    def __reduce__(self):
+        return (LazySource, (self.data, self.children))
+
+    def tokenize(self, start, end, symbols):
+        """
+        tokens of `data[start:end]`, as `get_segments_complex` gives them, except that blocks are left as `LazyBlock`s
+        """
+        data = self.data
+        findall = complex_token_re.findall
+        intern = symbols.setdefault
+        append = list.append
+        new = list.__new__
+        kids = self.children.get(start, ())
+        result = []
+        separation = False
+        eq_no_separate = False
+        pos = start
+        i = 0
+        while True:
+            stop = kids[i] - 1 if i < len(kids) else end
+            # same as `get_segments_complex`, without braces
+            for ws, x, sp in findall(data, pos, stop):
+                if ws:
+                    separation = True
+                if sp:
+                    x = sp
+                    if x == b'=' and not eq_no_separate:
+                        separation = True
+                elif not x:
+                    continue
+                if eq_no_separate:
+                    eq_no_separate = False
+                if x == b'>' or x == b'<' or x == b'!':
+                    eq_no_separate = True
+                if separation or not result or isinstance(result[-1], list):
+                    append(result, intern(x, x))
+                else:
+                    y = result[-1] + x
+                    result[-1] = intern(y, y)
+                if x != b'=':
+                    separation = False
+            if i >= len(kids):
+                return result
+            # `LazyBlock(self, kids[i], kids[i + 1])` without the calls to `__init__`
+            y = new(LazyBlock)
+            y.fields_cache = None
+            y.span = (self, kids[i], kids[i + 1])
+            append(result, y)
+            pos = kids[i + 1] + 1
+            i += 2
+
+def get_segments_lazy(scr, symbols=None):
+    """
+    complex mode parser that only tokenizes the top level of `scr`. each `{ ... }` becomes a `LazyBlock`,
+    which is tokenized the same way when it is first accessed, so that blocks nobody looks into are never tokenized
+    and are exported as they were written.\n
+    fully accessed, the output is the same as `get_segments_complex`. see there for `symbols`
+    """
+    if lazy_unsafe_re.search(scr):
+        return get_segments_complex(scr, symbols)
+    if scr.__class__ is not bytes:
+        scr = bytes(scr) # blocks outlive the mapping of the file
+    children = {}
+    stack = []
+    kids = []
+    for m in lazy_brace_re.finditer(scr):
+        match m.group():
+            case b'{':
+                stack.append((kids, m.end()))
+                kids = []
+            case b'}':
+                if not stack:
+                    break
+                parent, start = stack.pop()
+                if kids:
+                    children[start] = kids
+                parent += (start, m.start())
+                kids = parent
+    else:
+        if not stack:
+            children[0] = kids
+            return LazySource(scr, children).tokenize(0, len(scr), {} if symbols is None else symbols)
+    # unbalanced braces. leave the error (or the unclosed block) to the complex parser
+    return get_segments_complex(scr, symbols)
+
+#######
+#
+# TIMINGS
+#
+#######
+
+class Timings:
+    """
+    wall time spent in each stage of the run, per (stage, modid, category), and the number of top-level entries per (modid, category).\n
+    the stages are\n
+        discover ... listing the script files\n
+        read ... reading them (waiting for the reader threads, see `ModCorpus.read_ahead`)\n
+        tokenize ... parsing them, or waiting for the worker processes (see `ModCorpus.prefetch`)\n
+        load ... unpickling and interning the parsed trees\n
+        split3 ... splitting the top-level entries\n
+        transform ... the generators working on the entries, `write_fields` excluded\n
+        export ... `write_fields`\n
+    time spent outside of any (modid, category), like writing the collected variables, is counted for `(None, None)`
+    """
+    stages = ['discover', 'read', 'tokenize', 'load', 'split3', 'transform', 'export']
+
+    def __init__(self):
+        self.spent = collections.defaultdict(float) # (stage, modid, cat) -> seconds
+        self.segments = {} # (modid, cat) -> number of top-level entries
+        self.current = (None, None) # (modid, cat) being processed
+        self.mark = None
+
+    def at(self, modid, cat):
+        self.current = (modid, cat)
+
+    @contextlib.contextmanager
+    def span(self, stage, modid=None, cat=None):
+        key = (stage, modid, cat) if modid is not None else (stage,) + self.current
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spent[key] += time.perf_counter() - t
+
+    def waiting(self, results, stage, todo):
+        """
+        yield from `results`, counting the time spent waiting for each of them as `stage` of the (modid, cat, ...) in `todo`
+        """
+        results = iter(results)
+        for modid, cat, *_ in todo:
+            t = time.perf_counter()
+            x = next(results)
+            self.spent[(stage, modid, cat)] += time.perf_counter() - t
+            yield x
+
+    def consuming(self):
+        """
+        call before handing an entry to a generator, and `consumed` when it comes back for the next one
+        """
+        self.mark = (time.perf_counter(), self.spent[('export',) + self.current])
+
+    def consumed(self):
+        t, export = self.mark
+        self.spent[('transform',) + self.current] += time.perf_counter() - t - (self.spent[('export',) + self.current] - export)
+
+    def totals(self):
+        out = dict.fromkeys(self.stages, 0.0)
+        for (stage, _, _), t in self.spent.items():
+            out[stage] += t
+        return out
+
+    def mod_table(self, corpus):
+        """
+        rows of (modid, bytes of script files, top-level entries, seconds), the slowest mods first
+        """
+        cats = set(x[2] for x in self.spent.keys() if x[1] is not None) | set(x[1] for x in self.segments.keys())
+        spent = collections.defaultdict(float)
+        for (_, modid, _), t in self.spent.items():
+            spent[modid] += t
+        rows = []
+        for modid in corpus.modids:
+            paths = itertools.chain.from_iterable(corpus.files.get((modid, cat), []) for cat in cats)
+            rows.append((
+                modid,
+                sum(corpus.sizes.get(p, 0) for p in paths),
+                sum(self.segments.get((modid, cat), 0) for cat in cats),
+                spent[modid],
+            ))
+        return sorted(rows, key=lambda x: -x[3])
+
+timings = Timings()
+
+#######
+#
+# SCRIPT INDEX
+#
+#######
+
+def dir_mtimes(base, cat):
+    """
+    mtime_ns of `base` and of each directory from it down to `base/cat`. None for the ones that do not exist
+    """
+    names = cat.split('/')
+    out = []
+    for i in range(len(names) + 1):
+        try:
+            out.append(os.stat(os.path.join(base, *names[:i])).st_mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            out.append(None)
+    return out
+
+class ScriptIndex:
+    """
+    listing of the script files of each (mod folder, category) kept across runs, stored as json.\n
+    a listing is reused as long as the mtimes of the mod folder and of each directory down to the category are unchanged.
+    adding, removing or renaming a file always changes the mtime of the directory containing it,
+    so only the categories where something happened are scanned again.\n
+    editing a file in place does not change any directory mtime, but the listing stays right then anyway
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = None # category directory -> [directory mtimes (see `dir_mtimes`), file names]
+        self.seen = set()
+        self.dirty = False
+        self.lock = threading.Lock() # `ModCorpus.discover` calls `scripts` from several threads
+
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            print("WARNING: could not load script index, rebuilding it", e)
+
+    def scripts(self, base, cat):
+        """
+        paths of the txt files directly under `base/cat`, same as `scan_scripts(os.path.join(base, cat))`
+        """
+        with self.lock:
+            if self.entries is None:
+                self.load()
+        d = os.path.join(base, cat)
+        self.seen.add(d)
+        mtimes = dir_mtimes(base, cat)
+        entry = self.entries.get(d)
+        if entry is not None and entry[0] == mtimes:
+            return [os.path.join(d, x) for x in entry[1]]
+        paths = scan_scripts(d)
+        self.entries[d] = [mtimes, [os.path.basename(p) for p in paths]]
+        self.dirty = True
+        return paths
+
+    def save(self):
+        """
+        write the index back to disk if anything changed. entries of removed mods are dropped here
+        """
+        if self.entries is None:
+            return
+        for d in list(self.entries.keys()):
+            if d not in self.seen and not os.path.isdir(d):
+                del self.entries[d]
+                self.dirty = True
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+script_index = ScriptIndex(os.path.join(os.path.dirname(os.path.abspath(__file__)), "script_index.json"))
+
+#######
+#
+# PARSE CACHE
+#
+#######
+
+PARSER_VERSION = 5 # bump this whenever the output of the parsers changes. the whole cache is discarded then
+
+class ParseCache:
+    """
+    on-disk cache of parsed script files, stored as a pickle file.\n
+    an entry is keyed by (file path, parser) and is only used while `mtime_ns` and size of the file stay the same,
+    so modified files get parsed again automatically.\n
+    each tree is kept pickled in memory, and `parse` unpickles a new copy on every call. like all parsed trees, it cannot be modified (see `Block`).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = None # (file path, parser name) -> (mtime_ns, size, pickled tree)
+        self.seen = set()
+        self.dirty = False
+
+    def load(self):
+        self.entries = {}
+        try:
+            with open(self.path, 'rb') as f:
+                version, entries = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print("WARNING: could not load parse cache, rebuilding it", e)
+            return
+        if version == PARSER_VERSION:
+            self.entries = entries
+
+    def get(self, p, f):
+        """
+        entry (mtime_ns, size, pickled tree) of the file at `p` parsed by `f`, or None if it is not cached or outdated
+        """
+        if self.entries is None:
+            self.load()
+        key = (os.path.normpath(p), f.__name__)
+        self.seen.add(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        st = os.stat(p)
+        if entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return entry
+        return None
+
+    def put(self, p, f, entry):
+        """
+        register `entry`, the output of `parse_script_file_pickled(p, f)`
+        """
+        if self.entries is None:
+            self.load()
+        self.entries[(os.path.normpath(p), f.__name__)] = entry
+        self.dirty = True
+
+    def parse(self, p, f):
+        entry = self.get(p, f)
+        if entry is None:
+            entry = parse_script_file_pickled(p, f)
+            self.put(p, f, entry)
+        return pickle.loads(entry[2])
+
+    def save(self):
+        """
+        write the cache back to disk if anything changed. entries of deleted files are dropped here
+        """
+        if self.entries is None:
+            return
+        for key in list(self.entries.keys()):
+            if key not in self.seen and not os.path.exists(key[0]):
+                del self.entries[key]
+                self.dirty = True
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as f:
+            pickle.dump((PARSER_VERSION, self.entries), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+def parse_script_file_pickled(p, f):
+    """
+    read the file at `p` and parse it with `f`. returns (mtime_ns, size, pickled tree).\n
+    this is a top-level function so that it can run in worker processes (see `ModCorpus.prefetch`)
+    """
+    with open(p, 'rb') as fp, map_file(fp) as scr:
+        st = os.fstat(fp.fileno())
+        tree = f(scr)
+    return (st.st_mtime_ns, st.st_size, pickle.dumps(tree, pickle.HIGHEST_PROTOCOL))
+
+parse_cache = ParseCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_cache.pickle"))
+
 def patchpath(p):
     return os.path.join(os.path.dirname(__file__), "../", p)
 
+@contextlib.contextmanager
+def open_output(p):
+    """
+    open the patch file at `patchpath(p)` for binary writing.\n
+    the data goes to a temporary file first, which replaces the old file only after everything is written,
+    so a failed run never leaves a half-written patch file behind.
+    """
+    path = patchpath(p)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        try:
+            yield f
+        except BaseException:
+            f.close()
+            os.remove(tmp)
+            raise
+    os.replace(tmp, path)
+
 def get_field(target, name):
     """
     Get a value corresponding `name` from target
-    REMEMBER that `target` must be in the format AFTER passing to split3.
+    REMEMBER that `target` must be in the format AFTER passing to split3, or a `Block`.
     """
+    if isinstance(target, (Fields, Block)):
+        return target.field(name)
     try:
         return next(filter(lambda x: x[0] == name, target))[2]
     except StopIteration:
@@ -226,52 +916,91 @@ def get_field_after(target: list, name, n=2):
     except ValueError:
         return None
 
+def replace_tokens(target, i, j, tokens):
+    """
+    new `Block` with the tokens of `target`, except that `target[i:j]` is replaced by `tokens`. `target` is left as it is
+    """
+    return Block(itertools.chain(target[:i], tokens, target[j:]))
+
+def join_fields(entries):
+    """
+    new `Block` made of `(name, op, value)` entries, i.e. the reverse of `split3`
+    """
+    out = Block(itertools.chain.from_iterable(entries))
+    out.fields_cache = Fields(entries)
+    return out
+
 def add_to_field(target, path, contents, inline_option):
     """
-    Add `contents` to the target, according to the path specified by `path`.
+    Copy of the target with `contents` added, according to the path specified by `path`.
     if the specified path does not exist, it will create one.
+    only the blocks along `path` are copied. everything else is shared with the target, which is left as it is.
     REMEMBER that `target` must be in the format BRFORE passing to split3, except in the case `path = []`, which means direct addition to the target.
     Also, all the subcomponents that is addressed by `path` (except the last item of `path`), must pass the sanity check from split3.
     """
     if len(path) == 0:
-        for c in contents:
-            target.append(c)
+        return Block(itertools.chain(target, contents))
+    spl = split3(target, inline_option)
+    for i, x in enumerate(spl):
+        if x[0] == path[0]:
+            spl[i] = (x[0], x[1], add_to_field(x[2], path[1:], contents, inline_option))
+            break
     else:
-        spl = split3(target, inline_option)
-        field = get_field(spl, path[0])
-        if field == None:
-            obj = [path[0], b'=', []]
-            target += obj
-            spl.append(obj)
-            field = obj[2]
-        add_to_field(field, path[1:], contents, inline_option)
+        spl.append((path[0], b'=', add_to_field(Block(), path[1:], contents, inline_option)))
+    return join_fields(spl)
 
-def export_fields(target, tabs=0):
+def export_tokens(parts, target, tabs=0):
     """
-    export fields as a byte string\n
-    REMEMBER that `target` must be in the format BRFORE passing to `split3` \n
-    (which means `target` must get concatenated after passing to `split3`)
+    append the exported form of `target` to the list `parts`, piece by piece.\n
+    the format is described in `export_fields`. blocks read by `get_segments_lazy` are written as they are in the script instead
     """
-    def routine(tup, token):
-        data, after_eq, line = tup
-        t = (b' ' * tabs)
-        if is_eq_like(token):
-            after_eq = 1
+    t = b' ' * tabs
+    after_eq = 0
+    line = True
+    for token in target:
         if isinstance(token, list):
-            data += b'{\n' + export_fields(token, tabs=tabs+4) + t +  b'}'
+            if (token.__class__ is Block or token.__class__ is LazyBlock) and token.span is not None:
+                # written straight from the script, with its original formatting
+                source, start, end = token.span
+                parts += (b'{', source.data[start:end], b'}')
+            else:
+                parts.append(b'{\n')
+                export_tokens(parts, token, tabs + 4)
+                parts.append(t + b'}')
         else:
-            data += (t if line else b'') + token + (b' ' if after_eq != 2 else b'')
-        
+            if is_eq_like(token):
+                after_eq = 1
+            if line:
+                parts.append(t)
+            parts.append(token)
+            if after_eq != 2:
+                parts.append(b' ')
         line = False
         if after_eq == 1:
-            after_eq += 1
+            after_eq = 2
         elif after_eq == 2:
-            data += b'\n'
+            parts.append(b'\n')
             after_eq = 0
             line = True
-        
-        return (data, after_eq, line)
-    return functools.reduce(routine, target, (b'', 0, True))[0]
+
+def export_fields(target, tabs=0):
+    """
+    export fields as a byte string\n
+    REMEMBER that `target` must be in the format BRFORE passing to `split3` \n
+    (which means `target` must get concatenated after passing to `split3`)
+    """
+    parts = []
+    export_tokens(parts, target, tabs)
+    return b''.join(parts)
+
+def write_fields(f, target):
+    """
+    same as `f.write(export_fields(target))`, without building the intermediate byte strings of the nested lists
+    """
+    with timings.span('export'):
+        parts = []
+        export_tokens(parts, target)
+        f.write(b''.join(parts))
 
 def nestedSearch(nested, v):
     """
@@ -298,155 +1027,583 @@ def nestedSearchList(nested, v):
     return False
 
 
-def nestedApply(nested, v):
+class Rules:
     """
-    execute v(x) recursively in given nested list, where x is a sub-list of given nested list
+    tree rewrites, each one added for the tokens it cares about (its keys).\n
+    `rewrite` walks a tree once, however many rules there are: each token is looked up in the table from keys to rules,
+    and each sub-list is entered after its own entries are rewritten (from the outside in).\n
+    a rule is called as `rule(x, i)`, where `x[i]` is one of its keys and `x` is the sub-list as it was before any rewrite,
+    and returns the tokens that replace the entry `x[i:i+3]`, or None to keep it.
+    the rules of a key are tried in the order they were added, until one of them returns something.
+    the returned tokens are not looked up again, but their sub-lists are entered
     """
-    v(nested)
-    for element in nested:
-        if isinstance(element, list):
-            nestedApply(element, v)
+    def __init__(self):
+        self.table = {} # key -> [rule]
+
+    def rule(self, *keys):
+        """
+        decorator adding a rule for `keys`
+        """
+        def register(f):
+            for k in keys:
+                self.table.setdefault(k, []).append(f)
+            return f
+        return register
+
+    def visit(self, x, enter):
+        """
+        `[x, tokens of x with the rules applied, positions of the sub-lists in those tokens (if they are to be entered), number of them entered]`
+        """
+        table = self.table
+        out = None
+        lists = []
+        done = 0 # tokens of `x` before this one are copied to `out`, or replaced
+        for i, t in enumerate(x):
+            if t.__class__ is not bytes:
+                if enter and i >= done:
+                    lists.append(i if out is None else i - done + len(out))
+            elif i >= done and t in table:
+                for rule in table[t]:
+                    r = rule(x, i)
+                    if r is not None:
+                        if out is None:
+                            out = []
+                        out += x[done:i]
+                        if enter:
+                            lists.extend(len(out) + k for k, y in enumerate(r) if y.__class__ is not bytes)
+                        out += r
+                        done = i + 3
+                        break
+        if out is None:
+            return [x, x, lists, 0]
+        out += x[done:]
+        return [x, out, lists, 0]
+
+    def rewrite(self, tree, depth=None):
+        """
+        copy of `tree` with the rules applied, or `tree` itself if none of them returned anything.
+        sub-lists in which nothing is replaced are shared with `tree`, which is left as it is (see `Block`).\n
+        `depth` ... how deep sub-lists are entered (0: only the entries of `tree` itself are rewritten), or None for no limit
+        """
+        stack = [self.visit(tree, depth != 0)]
+        while True:
+            frame = stack[-1]
+            x, out, lists, k = frame
+            if k < len(lists):
+                frame[3] = k + 1
+                stack.append(self.visit(out[lists[k]], depth is None or len(stack) < depth))
+                continue
+            stack.pop()
+            if out is not x:
+                out = Block(out) if isinstance(x, Block) else x.__class__(out)
+            if not stack:
+                return out
+            if out is not x:
+                parent = stack[-1]
+                if parent[1] is parent[0]:
+                    parent[1] = list(parent[0])
+                parent[1][parent[2][parent[3] - 1]] = out
 
 #######
 #
-# Indivisual scripts for mods
+# MOD CORPUS
 #
 #######
 
-# buildings
-
-def all_buildings():
-    var_def_table = {}
-    out = b""
+# parsers used by `ModCorpus.definitions` for categories where the generators only need part of the entries
+category_parsers = {
+    "common/buildings": get_segments_prefiltered, # only buildings with num_pops / num_sapient_pops are rewritten
+    "common/pop_jobs": get_segments_lazy, # most job properties are passed through as they are
+}
 
-    for modid in ['v'] + os.listdir(stellaris_path):
-        if modid == 'v' or os.path.isdir(os.path.join(stellaris_path, modid)):
+class ModCorpus:
+    """
+    script files of vanilla (modid `'v'`) and of all the enabled mods, shared by all the generators in a run.\n
+    files of each (modid, category) are listed at most once, and each file is parsed and loaded at most once.\n
+    the loaded trees are shared by all the callers, which never modify them (see `Block`).
+    """
+    def __init__(self):
+        self.modids = []
+        with os.scandir(env.stellaris_path) as it:
+            mod_dirs = [e.name for e in it if e.is_dir()]
+        for modid in ['v'] + mod_dirs:
+            if modid in env.mod_excludes:
+                print('skipping modid ', modid)
+                continue
+            self.modids.append(modid)
+        inline_scripts.use(self)
+        scripted_variables.use(self)
+        self.files = {} # (modid, cat) -> paths
+        self.blobs = {} # (path, parser) -> pickled tree, until it is loaded
+        self.trees = {} # (path, parser) -> loaded tree
+        self.sizes = {} # path -> size of the file
+
+    def scripts(self, modid, cat):
+        """
+        get paths of all txt files under `cat` of the mod
+        """
+        key = (modid, cat)
+        if key not in self.files:
+            with timings.span('discover', modid, cat):
+                if modid == 'v':
+                    self.files[key] = list(get_scripts(env.stellaris_game_path, '.', "%s/*.txt" % cat))
+                else:
+                    self.files[key] = list(get_scripts(env.stellaris_path, modid, "%s/*.txt" % cat))
+        return self.files[key]
+
+    def mod_path(self, modid):
+        if modid == 'v':
+            return os.path.join(env.stellaris_game_path, '.')
+        return os.path.join(env.stellaris_path, modid)
+
+    def discover(self, cats, threads):
+        """
+        list the script files under `cats` of all the mods at once, scanning up to `threads` directories concurrently.\n
+        on slow (network / HDD) volumes the latency of the directory reads dominates, and overlapping them hides most of it
+        """
+        keys = [(modid, cat) for modid in self.modids for cat in cats if (modid, cat) not in self.files]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as ex:
+            for _ in ex.map(lambda k: self.scripts(*k), keys):
+                pass
+
+    def parser(self, cat, simple=False):
+        """
+        parser used for the files under `cat` by `definitions`. see `category_parsers`
+        """
+        return get_segments_simple if simple else category_parsers.get(cat, get_segments_complex)
+
+    def missing(self, cats, simple):
+        """
+        (modid, cat, path, parser) of the files under `cats` that are neither loaded nor in the parse cache. cached ones are loaded on the way
+        """
+        todo = []
+        for modid in self.modids:
+            for cat in cats:
+                f = self.parser(cat, simple)
+                for p in self.scripts(modid, cat):
+                    if (p, f) in self.trees or (p, f) in self.blobs:
+                        continue
+                    entry = parse_cache.get(p, f) if PARSE_CACHE else None
+                    if entry is None:
+                        todo.append((modid, cat, p, f))
+                    else:
+                        self.add(p, f, entry)
+        return todo
+
+    def add(self, p, f, entry):
+        self.blobs[(p, f)] = entry[2]
+        self.sizes[p] = entry[1]
+
+    def blob(self, p, f=get_segments_complex):
+        """
+        pickled tree of the file at `p` parsed by `f`, parsed now if it is neither loaded nor in the parse cache
+        """
+        key = (p, f)
+        if key not in self.blobs:
+            entry = parse_cache.get(p, f) if PARSE_CACHE else None
+            if entry is None:
+                # the file is memory-mapped, so reading it happens while it is tokenized
+                with timings.span('tokenize'):
+                    entry = parse_script_file_pickled(p, f)
+                if PARSE_CACHE:
+                    parse_cache.put(p, f, entry)
+            self.add(p, f, entry)
+        return self.blobs[key]
+
+    def parse(self, p, f=get_segments_complex):
+        """
+        tree of the file at `p` parsed by `f`. in complex mode, all tokens are registered in the shared `symbol_table`.\n
+        the tree is loaded on the first call and shared by all the callers. DO NOT modify it
+        """
+        key = (p, f)
+        if key not in self.trees:
+            blob = self.blob(p, f)
+            with timings.span('load'):
+                tree = pickle.loads(blob)
+                if f is not get_segments_simple:
+                    tree = intern_tree(tree, symbol_table)
+            self.trees[key] = tree
+            del self.blobs[key]
+        return self.trees[key]
+
+    def prefetch(self, cats, jobs, simple=False):
+        """
+        parse all files under `cats` of all the mods ahead of time, in `jobs` worker processes.\n
+        the generators still visit the mods in `self.modids` order and get exactly the same trees as in a serial run,
+        so the output (and the overwrite resolution by `calculate_mod_index_from_mod_order`) does not change.
+        """
+        todo = self.missing(cats, simple)
+        if len(todo) == 0:
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as ex:
+            results = ex.map(parse_script_file_pickled, [x[2] for x in todo], [x[3] for x in todo], chunksize=max(1, len(todo) // (jobs * 4)))
+            # the time spent waiting for each file is counted as tokenizing it
+            for (modid, cat, p, f), entry in zip(todo, timings.waiting(results, 'tokenize', todo)):
+                timings.at(modid, cat)
+                if PARSE_CACHE:
+                    parse_cache.put(p, f, entry)
+                self.add(p, f, entry)
+        timings.at(None, None)
+
+    def read_ahead(self, cats, threads, simple=False):
+        """
+        parse all files under `cats` of all the mods ahead of time in this process,
+        while up to `threads` threads read the next files from disk, so that parsing and waiting for the disk overlap.\n
+        only used with `--read-ahead`: the files are read whole instead of memory-mapped, and all of them are parsed
+        (and kept in `self.blobs`) before the first generator runs, so the first output comes later than when they are parsed on demand
+        """
+        todo = self.missing(cats, simple)
+        paths = [x[2] for x in todo]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as ex:
+            # the time spent waiting for each file is counted as reading it
+            for (modid, cat, p, f), (mtime_ns, size, scr) in zip(todo, timings.waiting(bounded_map(ex, read_script_file, paths, threads * 4), 'read', todo)):
+                timings.at(modid, cat)
+                with timings.span('tokenize'):
+                    entry = (mtime_ns, size, pickle.dumps(f(scr), pickle.HIGHEST_PROTOCOL))
+                if PARSE_CACHE:
+                    parse_cache.put(p, f, entry)
+                self.add(p, f, entry)
+        timings.at(None, None)
+
+    def definitions(self, cat, inline_option):
+        """
+        lazily yield `(modid, entry)` for every top-level entry (split3 tuple) under `cat` of all the mods, in corpus order.\n
+        each file is loaded and split only when the entries before it have been consumed.
+        the entries share the trees loaded by `parse`, so later calls (and other generators) do not load them again.\n
+        the `@variable` definitions met on the way are registered in `scripted_variables`
+        """
+        for modid in self.modids:
             print('processing modid ', modid)
+            timings.at(modid, cat)
+            n = 0
+            local_variables = {}
+            f = self.parser(cat)
+            for p in self.scripts(modid, cat):
+                tree = self.parse(p, f)
+                with timings.span('split3'):
+                    entries = split3(tree, inline_option)
+                n += len(entries)
+                for entry in entries:
+                    if entry[0].startswith(b"@"):
+                        local_variables[entry[0]] = entry[2]
+                    timings.consuming()
+                    yield modid, entry
+                    timings.consumed()
+            timings.segments[(modid, cat)] = n
+            scripted_variables.locals[(modid, cat)] = local_variables
+        timings.at(None, None)
 
-            if modid in mod_excludes:
-                print(" .... skipping this mod")
-                continue
+#######
+#
+# INLINE SCRIPTS
+#
+#######
+
+# `$PARAM$` or `$PARAM|default$` in an inline script
+inline_param_re = re.compile(rb'\$(\w+)(?:\|([^$]*))?\$')
+
+def substitute_params(tree, params):
+    """
+    copy of `tree` with each `$PARAM$` replaced by `params[PARAM]` (or its default). unknown parameters are left as they are.\n
+    tokens are substituted one by one, and a token that is no longer a single token after the substitution is tokenized again
+    """
+    out = []
+    for x in tree:
+        if x.__class__ is not bytes:
+            out.append(substitute_params(x, params))
+        elif b'$' in x:
+            y = inline_param_re.sub(lambda m: params.get(m.group(1), m.group(2) if m.group(2) is not None else m.group(0)), x)
+            out.extend(get_segments_complex(y))
+        else:
+            out.append(x)
+    return Block(out) if isinstance(tree, Block) else out
 
-            if modid == 'v':
-                all_segments = split3(get_segments_from_category(stellaris_game_path, '.', "common/buildings", simple=False), InlineOption.Substitute)
+class InlineScripts:
+    """
+    expands `inline_script = name` and `inline_script = { script = name PARAM = value ... }` entries as the game does.\n
+    `name` is `common/inline_scripts/name.txt` of the mod loaded last among the ones that have it (vanilla always loses).\n
+    each template is parsed once through `ModCorpus.parse` (so the parse cache applies), and the expansion of each
+    (template, parameters) is kept and shared by all the callers, as the parsed trees are
+    """
+    max_depth = 16 # inline scripts may use other inline scripts
+
+    def __init__(self):
+        self.use(None)
+
+    def use(self, corpus):
+        """
+        look the templates up among the mods of `corpus`
+        """
+        self.corpus = corpus
+        self.table = None # template name -> path
+        self.expanded = {} # (template name, parameters) -> entries
+
+    def templates(self):
+        """
+        dict from each template name to its file
+        """
+        if self.table is None:
+            self.table = {}
+            for modid in sorted(self.corpus.modids, key=calculate_mod_index_from_mod_order):
+                root = os.path.join(self.corpus.mod_path(modid), "common", "inline_scripts")
+                for d, _, names in os.walk(root):
+                    for n in names:
+                        if n.endswith('.txt'):
+                            p = os.path.join(d, n)
+                            self.table[os.path.relpath(p, root)[:-4].replace(os.sep, '/').encode()] = p
+        return self.table
+
+    def expand(self, spl, depth=0):
+        """
+        `spl` (split3 entries) with each `inline_script` entry replaced by the entries of its template
+        """
+        out = Fields()
+        for x in spl:
+            if x[0] == b'inline_script':
+                out += self.instantiate(x[2], depth)
             else:
-                all_segments = split3(get_segments_from_category(stellaris_path, modid, "common/buildings", simple=False), InlineOption.Substitute)
-            
-            building_defs = list(filter(lambda x: not x[0].startswith(b"@"), all_segments))
-            var_defs = list(filter(lambda x: x[0].startswith(b"@"), all_segments))
-            
-            def search(x):
-                if b"num_pops" in x:
-                    i = x.index(b"num_pops")
-                    return is_eq_like(x[i+1]) and re.match(rb"\d+", x[i+2])
-                elif b"num_sapient_pops" in x:
-                    i = x.index(b"num_sapient_pops")
-                    return is_eq_like(x[i+1]) and re.match(rb"\d+", x[i+2])
-                else:
-                    return False
-            
-            # TODO: sapient
-            def apply(x):
-                indices = [i for i, v in enumerate(x) if v == b"num_pops" or v == b"num_sapient_pops"]
-                for i in indices:
-                    # MYCOMPAT_st_totalpop = { MORE = %s }
-                    x[i] = b"MYCOMPAT_st_totalpop"
-                    n = x[i + 2]
-                    if n.startswith(b"@"):
-                        n = [z[2] for z in var_defs if z[0] == n][0]
-                    match x[i + 1]:
-                        case b'>=':
-                            r = [ b"MORE", b"=", str(int(n) - 1).encode()]
-                        case b'<=':
-                            r = [ b"LESS", b"=", str(int(n) + 1).encode()]
-                        case b'>':
-                            r = [ b"MORE", b"=", str(int(n)).encode()]
-                        case b'<':
-                            r = [ b"LESS", b"=", str(int(n)).encode()]
-                        case _:
-                            raise NotImplementedError("ERROR: unsupported num_pops / num_sapient_pops")
-                    x[i + 1] = b"="
-                    x[i + 2] = r
-            
-            building_overrides = []
-            
-            for building_def in building_defs:
-                if nestedSearchList(building_def, search):
-                    nestedApply(building_def, apply)
-                    building_overrides.append(building_def)
-            
-            if len(building_overrides):
-                for v in var_defs:
-                    if v[0] in var_def_table and var_def_table[v[0]] != v[2]:
-                        print("WARNING!!! variable already registered!!!!!! %s : prev value %s <-> conflicting value %s" % (v[0],  var_def_table[v[0]], v[2]))
-                    var_def_table[v[0]] = v[2]
-                
-                for ov in building_overrides:
-                    out += export_fields(ov)
-
-    for x, y in var_def_table.items():
-        out = export_fields([x, b'=', y]) + out
-                
-    with open(patchpath("common/buildings/%sbuildings_patch.txt" % file_prefix), "wb") as f:
-        f.write(out)
+                out.append(x)
+        return out
+
+    def instantiate(self, value, depth):
+        if isinstance(value, list):
+            try:
+                fields = make_fields(value)
+            except AssertionError:
+                print("WARNING: malformed inline_script entry, dropping it", value)
+                return []
+            name = get_field(fields, b'script')
+            params = tuple(sorted((x[0], x[2].strip(b'"')) for x in fields if x[0] != b'script' and x[2].__class__ is bytes))
+        else:
+            name = value
+            params = ()
+        key = (name.strip(b'"') if name.__class__ is bytes else None, params)
+        if key not in self.expanded:
+            self.expanded[key] = self.build(key[0], dict(params), depth)
+        return self.expanded[key]
+
+    def build(self, name, params, depth):
+        p = self.templates().get(name)
+        if p is None:
+            print("WARNING: inline script %s not found, dropping it" % name)
+            return []
+        if depth >= self.max_depth:
+            print("WARNING: inline scripts nested too deep at %s, dropping it" % name)
+            return []
+        tree = substitute_params(self.corpus.parse(p), params)
+        try:
+            return self.expand(make_fields(tree), depth + 1)
+        except AssertionError:
+            print("WARNING: inline script %s is not a list of `name = value`, dropping it" % name)
+            return []
+
+inline_scripts = InlineScripts()
 
-# jobs
+#######
+#
+# SCRIPTED VARIABLES
+#
+#######
+
+class ScriptedVariables:
+    """
+    index of `@name = value` definitions, shared by all the generators.\n
+    global ones come from `common/scripted_variables` of all the mods, the mod loaded last winning (vanilla always loses).\n
+    local ones are the top-level definitions in the script files of a category, per (modid, category).
+    they are registered by `ModCorpus.definitions`, or collected on the first lookup if no generator went through that category yet.
+    a later definition of the same name replaces an earlier one
+    """
+    def __init__(self):
+        self.use(None)
+
+    def use(self, corpus):
+        self.corpus = corpus
+        self.globals = None # name -> value
+        self.locals = {} # (modid, cat) -> {name: value}
+
+    def global_table(self):
+        if self.globals is None:
+            self.globals = {}
+            rank = {}
+            for modid in self.corpus.modids:
+                r = calculate_mod_index_from_mod_order(modid)[0]
+                for p in self.corpus.scripts(modid, "common/scripted_variables"):
+                    try:
+                        entries = make_fields(self.corpus.parse(p))
+                    except AssertionError:
+                        print("WARNING: could not read scripted variables of %s, skipping the file" % p)
+                        continue
+                    for x in entries:
+                        if x[0].startswith(b"@") and r >= rank.get(x[0], r):
+                            rank[x[0]] = r
+                            self.globals[x[0]] = x[2]
+        return self.globals
+
+    def local(self, modid, cat):
+        """
+        dict of the variables defined in the script files under `cat` of the mod
+        """
+        if (modid, cat) not in self.locals:
+            table = {}
+            for p in self.corpus.scripts(modid, cat):
+                for x in split3(self.corpus.parse(p, self.corpus.parser(cat)), InlineOption.Substitute):
+                    if x[0].startswith(b"@"):
+                        table[x[0]] = x[2]
+            self.locals[(modid, cat)] = table
+        return self.locals[(modid, cat)]
+
+    def get(self, name, modid, cat):
+        """
+        value of the variable `name` as seen from the script files under `cat` of the mod: its local definition, or else the global one
+        """
+        table = self.local(modid, cat)
+        if name in table:
+            return table[name]
+        return self.global_table()[name]
+
+    def merged(self, cat):
+        """
+        local variables under `cat` of all the mods in one dict, in corpus order. a warning is printed for conflicting definitions
+        """
+        out = {}
+        for modid in self.corpus.modids:
+            for name, value in self.local(modid, cat).items():
+                if name in out and out[name] != value:
+                    print("WARNING!!! variable already registered!!!!!! %s : prev value %s <-> conflicting value %s" % (name,  out[name], value))
+                out[name] = value
+        return out
+
+scripted_variables = ScriptedVariables()
+
+#######
+#
+# Indivisual scripts for mods
+#
+#######
+
+# overwrites
 
 def calculate_mod_index_from_mod_order(m):
     if m == 'v':
         return (-99999, m)
     else:
-        return (mod_order.index(m), m)
+        return (env.mod_rank[m], m)
 
-def all_jobs():
+def resolve_overwrites(names_by_mod):
     """
-    ALL JOBS PATCH!
+    `names_by_mod` ... iterable of (modid, definition name) in corpus order.\n
+    returns a dict from each definition name to the mod whose definition wins, i.e. the mod loaded last (vanilla always loses)
     """
+    winner = {}
+    winner_rank = {}
+    for modid, name in names_by_mod:
+        rank = calculate_mod_index_from_mod_order(modid)[0]
+        if name not in winner_rank or rank > winner_rank[name]:
+            winner_rank[name] = rank
+            winner[name] = modid
+    return winner
 
-    """
-    ========================
-     Generate Job & Deposit
-    ========================
-    """
-    job_output = b''
-    deposit_output = b''
-    sv_output = b''
+# buildings
 
-    job_to_modid = {}
-    job_def_table = {}
+def all_buildings(corpus):
     var_def_table = {}
 
-    for modid in ['v'] + os.listdir(stellaris_path):
-        if modid == 'v' or os.path.isdir(os.path.join(stellaris_path, modid)):
-            print('processing modid ', modid)
+    # first pass: only names are kept (variables go to `scripted_variables`), to know the overwrite winners before any building is transformed
+    building_names = [] # (modid, building name)
+
+    for modid, x in corpus.definitions("common/buildings", InlineOption.Substitute):
+        if not x[0].startswith(b"@"):
+            building_names.append((modid, x[0]))
+
+    # only the definition from the mod loaded last is used by the game
+    building_winner = resolve_overwrites(building_names)
+    del building_names
+
+    rules = Rules()
+    matched = False # whether the building being rewritten compares its pops to a number anywhere
+    errors = [] # entries of the building being rewritten that could not be converted. only raised if the building is written
+
+    # TODO: sapient
+    @rules.rule(b"num_pops", b"num_sapient_pops")
+    def totalpop(x, i):
+        nonlocal matched
+        # only the first num_pops of a block is checked (or its first num_sapient_pops, if it has no num_pops)
+        if x.index(x[i]) == i and (x[i] == b"num_pops" or b"num_pops" not in x):
+            matched = matched or bool(is_eq_like(x[i+1]) and re.match(rb"\d+", x[i+2]))
+        try:
+            # MYCOMPAT_st_totalpop = { MORE = %s }
+            n = x[i + 2]
+            if n.startswith(b"@"):
+                n = scripted_variables.get(n, modid, "common/buildings")
+            match x[i + 1]:
+                case b'>=':
+                    r = [ b"MORE", b"=", str(int(n) - 1).encode()]
+                case b'<=':
+                    r = [ b"LESS", b"=", str(int(n) + 1).encode()]
+                case b'>':
+                    r = [ b"MORE", b"=", str(int(n)).encode()]
+                case b'<':
+                    r = [ b"LESS", b"=", str(int(n)).encode()]
+                case _:
+                    raise NotImplementedError("ERROR: unsupported num_pops / num_sapient_pops")
+        except Exception as e:
+            # such as `num_pops > value:some_sv`, fine as long as the building is not matched
+            errors.append(e)
+            return None
+        return [b"MYCOMPAT_st_totalpop", b"=", r]
+    
+    # second pass: the overrides are streamed to a spool file, as the variables they use have to be written before them
+    with tempfile.TemporaryFile() as spool:
+        registered = set() # mods whose variables are in var_def_table
 
-            if modid in mod_excludes:
-                print(" .... skipping this mod")
+        for modid, building_def in corpus.definitions("common/buildings", InlineOption.Substitute):
+            if building_def[0].startswith(b"@") or building_winner[building_def[0]] != modid:
                 continue
 
-            if modid == 'v':
-                all_segments = split3(get_segments_from_category(stellaris_game_path, '.', "common/pop_jobs", simple=False), InlineOption.Substitute)
-            else:
-                all_segments = split3(get_segments_from_category(stellaris_path, modid, "common/pop_jobs", simple=False), InlineOption.Substitute)
+            matched = False
+            errors.clear()
+            building_def = rules.rewrite(building_def) # `totalpop` looks variables up for `modid`
+            if matched:
+                if errors:
+                    raise errors[0]
+                if modid not in registered:
+                    registered.add(modid)
+                    for name, value in scripted_variables.local(modid, "common/buildings").items():
+                        if name in var_def_table and var_def_table[name] != value:
+                            print("WARNING!!! variable already registered!!!!!! %s : prev value %s <-> conflicting value %s" % (name,  var_def_table[name], value))
+                        var_def_table[name] = value
+                write_fields(spool, building_def)
+
+        spool.seek(0)
+        with open_output("common/buildings/%sbuildings_patch.txt" % file_prefix) as f:
+            # variables are written in reverse order of registration
+            for x, y in reversed(var_def_table.items()):
+                write_fields(f, [x, b'=', y])
+            shutil.copyfileobj(spool, f)
 
-            job_defs = list(filter(lambda x: not x[0].startswith(b"@"), all_segments))
+# jobs
 
-            var_defs = list(filter(lambda x: x[0].startswith(b"@"), all_segments))
-            for v in var_defs:
-                if v[0] in var_def_table and var_def_table[v[0]] != v[2]:
-                    print("WARNING!!! variable already registered!!!!!! %s : prev value %s <-> conflicting value %s" % (v[0],  var_def_table[v[0]], v[2]))
-                var_def_table[v[0]] = v[2]
+def all_jobs(corpus):
+    """
+    ALL JOBS PATCH!
+    """
 
-            jobnames = list([y[0] for y in job_defs])
-            for n in jobnames:
-                if not n in job_to_modid:
-                    job_to_modid[n] = []
-                job_to_modid[n].append(modid)
-            
-            job_def_table[modid] = job_defs
+    """
+    ========================
+     Generate Job & Deposit
+    ========================
+    """
+    job_to_modid = {}
+
+    # first pass: only names are kept (variables go to `scripted_variables`), to know the overwrite winner of each job before any job is transformed
+    for modid, x in corpus.definitions("common/pop_jobs", InlineOption.Substitute):
+        if not x[0].startswith(b"@"):
+            job_to_modid.setdefault(x[0], []).append(modid)
+    var_def_table = scripted_variables.merged("common/pop_jobs")
 
     job_overwrites = list(filter(lambda x: len(x[1]) > 1, job_to_modid.items()))
     print('%s job overwrites. ' % len(job_overwrites))
+    job_winner = resolve_overwrites((modid, jn) for jn, modids in job_to_modid.items() for modid in modids)
 
     job_props = set() # job property name for debugging
     all_modifiers = set() # all modifiers name for debugging
@@ -463,19 +1620,36 @@ def all_jobs():
             all_mod_multid_rev[all_mod_multid[mult]] = mult
         return all_mod_multid[mult]
 
-    for modid, job_defs in job_def_table.items():
-        for seg in job_defs:
+    resource_rules = Rules() # for the entries of `resources` / `overlord_resources`
+
+    @resource_rules.rule(b'produces', b'upkeep')
+    def job_quantity(x, i):
+        nonlocal danger
+        value = x[i + 2]
+        if b'multiplier' in value:
+            j = value.index(b'multiplier') + 2
+            danger += 1 # be cautious as there's a possibility that the script value won't work
+            return [x[i], x[i + 1], replace_tokens(value, j, j + 1, [b'value:%s|JOB|%s|' % (get_mod_multid(value[j]), jn)])]
+        return [x[i], x[i + 1], replace_tokens(value, 0, 0, [b'multiplier', b'=', b'planet.value:MYCOMPAT_sv_job_quantity|JOB|%s|' % jn])]
+
+    with open_output("common/pop_jobs/%sall_jobs_patch.txt" % file_prefix) as job_f, open_output("common/deposits/%sall_jobs_patch.txt" % file_prefix) as deposit_f:
+        # variables are written in reverse order of registration
+        for x, y in reversed(var_def_table.items()):
+            write_fields(job_f, [x, b'=', y])
+
+        # second pass: each job is transformed and written as soon as it is read
+        for modid, seg in corpus.definitions("common/pop_jobs", InlineOption.Substitute):
             jn = seg[0]
-            spl = split3(seg[2], inline_option=InlineOption.DoNothing)
+            if jn.startswith(b"@"):
+                continue
+            spl = split3(seg[2], inline_option=InlineOption.Substitute)
 
             if jn in job_excludes:
                 print("manually excluded job detected. Discarding this one.", jn, modid)
                 continue
 
-            job_modids = job_to_modid[jn]
-            if len(job_modids) > 1:
-                _, max_modid = max([calculate_mod_index_from_mod_order(m) for m in job_modids], key=lambda x: x[0])
-                if modid == max_modid:
+            if len(job_to_modid[jn]) > 1:
+                if modid == job_winner[jn]:
                     print("job overwrite detected: using this mod")
                 else:
                     print("job overwrite detected: skip this mod")
@@ -484,17 +1658,17 @@ def all_jobs():
             # if capped by modifier, change condition to disable it
             # TODO: implement another logic to make use of it (for example, calculate from workshop residue value)
             if get_field(spl, b'is_capped_by_modifier') == b'no':
-                add_to_field(seg[2], [b'possible', b'planet'], [b'MYCOMPAT_st_is_enabled', b'=', b'no'], InlineOption.DoNothing)
+                seg = (jn, seg[1], add_to_field(seg[2], [b'possible', b'planet'], [b'MYCOMPAT_st_is_enabled', b'=', b'no'], InlineOption.DoNothing))
                 print('Overwriting a job that is not capped by modifier ... %s' % jn.decode())
-                job_output += export_fields(seg)
+                write_fields(job_f, seg)
                 continue
-            
+        
             proxyjob_params = [] # proxy job params
 
             danger = 0 # error value for job
 
             icon_present = False
-            
+        
             # iterate job properties
             for property in spl:
                 prop_name = property[0]
@@ -502,26 +1676,14 @@ def all_jobs():
 
                 # log property name
                 job_props.add(prop_name)
-            
+        
                 match prop_name:
                     case b'overlord_resources' | b'resources':
                         for x in split3(prop_value, InlineOption.DoNothing):
-                            match x[0]:
-                                case b'produces' | b'upkeep':
-                                    if b'multiplier' in x[2]:
-                                        val = x[2][x[2].index(b'multiplier') + 2]
-                                        x[2][x[2].index(b'multiplier') + 2] = b'value:%s|JOB|%s|' % (get_mod_multid(val), jn)
-                                        danger += 1 # be cautious as there's a possibility that the script value won't work
-                                    else:
-                                        x[2].insert(0, b'planet.value:MYCOMPAT_sv_job_quantity|JOB|%s|' % jn)
-                                        x[2].insert(0, b'=')
-                                        x[2].insert(0, b'multiplier')
-                                case b'category':
-                                    pass
-                                case x:
-                                    print('unsupported resource type %s' % x)
-                                    danger += 100000000
-                        proxyjob_params += [prop_name, b'=', prop_value]
+                            if x[0] not in (b'produces', b'upkeep', b'category'):
+                                print('unsupported resource type %s' % x[0])
+                                danger += 100000000
+                        proxyjob_params += [prop_name, b'=', resource_rules.rewrite(prop_value, depth=0)]
                     case b'pop_modifier' | b'planet_modifier' | b'country_modifier' | b'triggered_pop_modifier' | b'triggered_planet_modifier' | b'triggered_country_modifier':
                         mult = None
                         potential = None
@@ -554,11 +1716,11 @@ def all_jobs():
                                     potential = mod[2]
                                 case y:
                                     send += mod
-                                        
+                                    
                             all_modifiers.add(mod[0]) # for debug purpose
-                        
+                    
                         #####
-                        
+                    
                         if send:
                             send_field_id = b'triggered_' + prop_name if not prop_name.startswith(b'triggered_') else prop_name
                             proxyjob_params += [
@@ -578,7 +1740,7 @@ def all_jobs():
                         proxyjob_params += [prop_name, b'=', prop_value]
                         if prop_name == b'icon':
                             icon_present = True
-            
+        
             danger_map[jn] = danger
 
             mycompat_jobs.append(jn)
@@ -599,62 +1761,184 @@ def all_jobs():
                 ]
             ]
 
-            deposit_output += export_fields([b'MYCOMPAT_d_%s' % jn, b'=', deposit_params])
+            write_fields(deposit_f, [b'MYCOMPAT_d_%s' % jn, b'=', deposit_params])
 
             if not icon_present:
                 proxyjob_params = [b'icon', b'=', jn] + proxyjob_params
 
-            job_output += export_fields([b'MYCOMPAT_j_%s' % jn, b'=', proxyjob_params])
+            write_fields(job_f, [b'MYCOMPAT_j_%s' % jn, b'=', proxyjob_params])
 
-    for x, y in var_def_table.items():
-        job_output = export_fields([x, b'=', y]) + job_output
 
     danger_jobs = list(filter(lambda x: x[1] > 0, danger_map.items()))
 
     print(len(danger_jobs), 'dangerous conversion detected')
 
-    with open(patchpath("autogen/danger_jobs.txt"), 'wb') as f:
+    with open_output("autogen/danger_jobs.txt") as f:
         for p in sorted(danger_jobs):
             f.write(b'%s %s\n' % (p[0], str(p[1]).encode()))
 
-    with open(patchpath("autogen/processed_jobs.txt"), 'wb') as f:
+    with open_output("autogen/processed_jobs.txt") as f:
         for p in sorted(danger_map.keys()):
             f.write(b'%s\n' % p)
 
-    with open(patchpath("autogen/job_props.txt"), 'wb') as f:
+    with open_output("autogen/job_props.txt") as f:
         for p in sorted(job_props):
             f.write(p + b'\n')
 
-    with open(patchpath("autogen/all_modifiers.txt"), 'wb') as f:
+    with open_output("autogen/all_modifiers.txt") as f:
         for p in sorted(all_modifiers):
             f.write(p + b'\n')
 
-    with open(patchpath("common/pop_jobs/%sall_jobs_patch.txt" % file_prefix), 'wb') as f:
-        f.write(job_output)
-
-    with open(patchpath("common/deposits/%sall_jobs_patch.txt" % file_prefix), 'wb') as f:
-        f.write(deposit_output)
-
     scripted_effects_data = [
         b'MYCOMPAT_agse_planet', b'=', 
         list(itertools.chain.from_iterable([b'MYCOMPAT_se_process_job', b'=', [ b'JOB', b'=', x ]] for x in mycompat_jobs))
     ]
 
-    with open(patchpath("common/scripted_effects/%sall_jobs_patch.txt" % file_prefix), 'wb') as f:
-        f.write(export_fields(scripted_effects_data))
+    with open_output("common/scripted_effects/%sall_jobs_patch.txt" % file_prefix) as f:
+        write_fields(f, scripted_effects_data)
 
-    for (svid, mult) in all_mod_multid_rev.items():
-        sv_output += export_fields([
-            svid, b'=', [
-                b'base', b'=', b'1',
-                b'mult', b'=', b'planet.value:MYCOMPAT_sv_job_quantity|JOB|$JOB$|', #PR_FACTOR_plnt_JOB_
-                b'mult', b'=', mult
-            ]
-        ]) + b'\n'
+    with open_output("common/script_values/%sall_jobs_patch.txt" % file_prefix) as f:
+        for (svid, mult) in all_mod_multid_rev.items():
+            write_fields(f, [
+                svid, b'=', [
+                    b'base', b'=', b'1',
+                    b'mult', b'=', b'planet.value:MYCOMPAT_sv_job_quantity|JOB|$JOB$|', #PR_FACTOR_plnt_JOB_
+                    b'mult', b'=', mult
+                ]
+            ])
+            f.write(b'\n')
+
+#######
+#
+# INCREMENTAL REGENERATION
+#
+#######
 
-    with open(patchpath("common/script_values/%sall_jobs_patch.txt" % file_prefix), 'wb') as f:
-        f.write(sv_output)
+# generator name -> (function, script categories it reads, config.py settings it depends on, patch files it writes)
+generators = {
+    'buildings': (all_buildings, ["common/buildings", "common/scripted_variables"], ['mod_excludes', 'mod_order'], [
+        "common/buildings/%sbuildings_patch.txt" % file_prefix,
+    ]),
+    'jobs': (all_jobs, ["common/pop_jobs"], ['mod_excludes', 'job_excludes', 'mod_order'], [
+        "common/pop_jobs/%sall_jobs_patch.txt" % file_prefix,
+        "common/deposits/%sall_jobs_patch.txt" % file_prefix,
+        "common/scripted_effects/%sall_jobs_patch.txt" % file_prefix,
+        "common/script_values/%sall_jobs_patch.txt" % file_prefix,
+    ]),
+}
+
+def config_value(name):
+    """
+    value of a config.py setting, either a plain variable or an attribute of `env`. sets are sorted so that the repr is stable
+    """
+    v = getattr(env, name) if hasattr(ModEnvironment, name) else globals()[name]
+    return sorted(v) if isinstance(v, (set, frozenset)) else v
+
+def input_fingerprint(corpus, cats, settings):
+    """
+    digest of everything a generator reads: the enabled mods in order, mtime and size of their script files under `cats`
+    and of all the inline scripts, the given config.py settings, and the parser / generator code itself
+    """
+    h = hashlib.sha256()
+    h.update(repr((PARSER_VERSION, settings, [config_value(x) for x in settings], corpus.modids)).encode())
+    st = os.stat(os.path.abspath(__file__))
+    h.update(repr((st.st_mtime_ns, st.st_size)).encode())
+    for modid in corpus.modids:
+        for cat in cats:
+            for p in sorted(corpus.scripts(modid, cat)):
+                st = os.stat(p)
+                h.update(repr((p, st.st_mtime_ns, st.st_size)).encode())
+    # inline scripts are expanded by all the generators
+    for name, p in sorted(inline_scripts.templates().items()):
+        st = os.stat(p)
+        h.update(repr((name, p, st.st_mtime_ns, st.st_size)).encode())
+    return h.hexdigest()
+
+class Manifest:
+    """
+    record of the input fingerprint each generator last ran with, stored as json.\n
+    a generator whose fingerprint is unchanged and whose patch files all exist does not have to run again
+    """
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError as e:
+            print("WARNING: could not load manifest, regenerating everything", e)
+            self.entries = {}
+
+    def is_fresh(self, name, fingerprint, outputs):
+        return self.entries.get(name) == fingerprint and all(os.path.exists(patchpath(p)) for p in outputs)
+
+    def update(self, name, fingerprint):
+        self.entries[name] = fingerprint
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp, self.path)
+
+manifest_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifest.json")
 
 if __name__ == "__main__":
-    all_buildings()
-    all_jobs()
+    parser = argparse.ArgumentParser(description="generate the mycompat patch files")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="number of worker processes used for parsing (default: 1)")
+    parser.add_argument("--threads", "-t", type=int, default=8, help="number of threads used for listing script files, and for reading them with --read-ahead (default: 8)")
+    parser.add_argument("--read-ahead", action="store_true", help="read and parse all the uncached script files before running the generators, with --threads threads reading ahead of the parser. helps on slow volumes, but the files are not memory-mapped, all the parsed files are kept until the end, and nothing is written until they are all parsed")
+    parser.add_argument("--profile", action="store_true", help="write a cProfile dump to autogen/profile.pstats and the cost of each mod to autogen/profile_mods.txt")
+    parser.add_argument("--force", "-f", action="store_true", help="regenerate all patch files, even if their inputs did not change")
+    parser.add_argument("--workshop-path", help="Stellaris workshop content directory (default: $MYCOMPAT_WORKSHOP_PATH or the Steam default)")
+    parser.add_argument("--game-path", help="Stellaris game directory (default: $MYCOMPAT_GAME_PATH or the Steam default)")
+    parser.add_argument("--exported-json", help="mod load list exported from the launcher (default: $MYCOMPAT_EXPORTED_JSON or autogen/exported.json)")
+    args = parser.parse_args()
+
+    env = ModEnvironment(args.workshop_path, args.game_path, args.exported_json)
+
+    # the corpus keeps the parsed trees alive until the end of the run. they have no reference cycles,
+    # and with the default thresholds the cycle collector keeps scanning them over and over
+    gc.set_threshold(10000, 10, 10)
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    started = time.perf_counter()
+    corpus = ModCorpus()
+    corpus.discover(list(itertools.chain.from_iterable(x[1] for x in generators.values())), args.threads)
+    print('found %s script files in %.2fs' % (sum(len(x) for x in corpus.files.values()), time.perf_counter() - started))
+    manifest = Manifest(manifest_path)
+
+    todo = []
+    for name, (f, cats, settings, outputs) in generators.items():
+        fingerprint = input_fingerprint(corpus, cats, settings)
+        if not args.force and manifest.is_fresh(name, fingerprint, outputs):
+            print('%s: inputs not changed, skipping' % name)
+            continue
+        todo.append((name, f, cats, fingerprint))
+
+    if args.jobs > 1:
+        corpus.prefetch(list(itertools.chain.from_iterable(x[2] for x in todo)), args.jobs)
+    elif args.read_ahead:
+        corpus.read_ahead(list(itertools.chain.from_iterable(x[2] for x in todo)), args.threads)
+    for name, f, cats, fingerprint in todo:
+        f(corpus)
+        manifest.update(name, fingerprint)
+    parse_cache.save()
+    script_index.save()
+    print('finished in %.2fs' % (time.perf_counter() - started))
+    print(', '.join('%s %.0f ms' % (stage, t * 1e3) for stage, t in timings.totals().items()))
+
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(os.path.dirname(os.path.abspath(__file__)), "profile.pstats"))
+        rows = timings.mod_table(corpus)
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "profile_mods.txt"), 'w') as f:
+            f.write('modid\tbytes\tsegments\tms\n')
+            for row in rows:
+                f.write('%s\t%s\t%s\t%.1f\n' % (row[:3] + (row[3] * 1e3,)))
+        print('slowest mods:')
+        for row in rows[:10]:
+            print('  %-12s %10s bytes %6s segments %8.1f ms' % (row[:3] + (row[3] * 1e3,)))
+        print('wrote autogen/profile.pstats (see `python -m pstats`) and autogen/profile_mods.txt')